@@ -4,20 +4,18 @@ import time
 from tkinter import messagebox
 
 from state.game_state import GameState, NetState
+from state.prediction import PaddlePredictor
 from net.client_net import ClientNet
+from pong import protocol
 
-def parse_lobby(payload: str):
-    items = []
-    statuses = []
-    if not payload:
-        return items, statuses
-    for chunk in payload.split(";"):
+def parse_lobby(items: list[str]):
+    rows = []
+    for chunk in items:
         parts = [x.strip() for x in chunk.split("|")]
         if len(parts) >= 3:
             name, role, st = parts[0], parts[1], parts[2]
-            items.append(f"{name:<10} | {role:<9} | {st}")
-            statuses.append(st)
-    return items, statuses
+            rows.append((name, f"{name:<10} | {role:<9} | {st}", st))
+    return rows
 
 def parse_kv(line: str) -> dict:
     parts = line.strip().split()
@@ -29,8 +27,6 @@ def parse_kv(line: str) -> dict:
     return out
 
 class GameController:
-    INTERP_DELAY_MS = 100
-
     def __init__(self, master, state: GameState):
         self.master = master
         self.state = state
@@ -43,6 +39,9 @@ class GameController:
         self._prev_dx = None
         self._prev_dy = None
         self._window_positioned = False
+        self._keys = {"UP": 0, "DOWN": 0}
+        self._predict = PaddlePredictor()  # our own paddle, ahead of the server
+        self._lobby_version = None  # None until a LOBBY snapshot, or while resyncing
 
         self._poll_job = None
         self._render_job = None
@@ -88,14 +87,18 @@ class GameController:
         self.state.match_state = "WAITING"
         self.state.sl = 0
         self.state.sr = 0
-        self.state.prev_net = None
-        self.state.curr_net = None
+        self.state.snaps.clear()
         self._prev_dx = None
         self._prev_dy = None
         self._window_positioned = False
+        self._keys = {"UP": 0, "DOWN": 0}
+        self._predict = PaddlePredictor()
+        self._lobby_version = None
 
         self.show_game()
         self.net.send_line(f"HELLO {username.strip()}")
+        self.net.send_line(f"PROTO {' '.join(protocol.PROTOS)} {protocol.LOBBY_DELTAS}")
+        self.net.send_line("UDP")  # servers without --udp-port ignore it
 
         if self._poll_job is None:
             self._schedule_poll()
@@ -142,7 +145,7 @@ class GameController:
     def send_chat(self, msg: str):
         if not self.state.connected:
             return
-        msg = (msg or "").strip()
+        msg = (msg or "").strip()[:protocol.CHAT_MAX_LEN]
         if not msg:
             return
         try:
@@ -153,8 +156,15 @@ class GameController:
     def send_input(self, key: str, is_down: int):
         if not self.state.connected:
             return
+        self._keys[key] = int(is_down)
+        seq = self._predict.input(self._keys["DOWN"] - self._keys["UP"])
         try:
-            self.net.send_line(f"INPUT {key} {int(is_down)}")
+            if self.net.udp_bound:
+                self.net.send_input(self._keys["UP"], self._keys["DOWN"], seq)
+            elif self.net.proto != "text":
+                self.net.send_bytes(protocol.encode_input(self._keys["UP"], self._keys["DOWN"], seq))
+            else:
+                self.net.send_line(f"INPUT {key} {int(is_down)} {seq}")
         except Exception:
             pass
 
@@ -165,13 +175,16 @@ class GameController:
         if not self.state.connected:
             return
         try:
-            lines = self.net.recv_lines()
+            items = self.net.poll()
         except Exception:
             self.disconnect()
             return
 
-        for line in lines:
-            self._handle_line(line)
+        for item in items:
+            if isinstance(item, NetState):
+                self._on_state(item)
+            else:
+                self._handle_line(item)
 
         self._schedule_poll()
 
@@ -185,8 +198,17 @@ class GameController:
 
         ns = self._interpolate()
         if ns:
+            ly, ry = ns.ly, ns.ry
+            # our paddle is predicted; everything else stays interpolated
+            if self.state.match_state == "PLAYING" and self.state.role in ("LEFT", "RIGHT"):
+                y = self._predict.advance(time.time())
+                if y is not None:
+                    if self.state.role == "LEFT":
+                        ly = y
+                    else:
+                        ry = y
             try:
-                self.game_view.update_scene(ns.ly, ns.ry, ns.bx, ns.by)
+                self.game_view.update_scene(ly, ry, ns.bx, ns.by)
                 self.game_view.set_score(ns.sl, ns.sr)
             except Exception:
                 pass
@@ -199,26 +221,7 @@ class GameController:
         self._schedule_render()
 
     def _interpolate(self):
-        pn = self.state.prev_net
-        cn = self.state.curr_net
-        if not pn or not cn:
-            return None
-
-        render_t = time.time() - (self.INTERP_DELAY_MS / 1000.0)
-
-        if render_t <= pn.t:
-            return pn
-        if render_t >= cn.t:
-            return cn
-
-        span = max(1e-6, cn.t - pn.t)
-        a = (render_t - pn.t) / span
-
-        ly = pn.ly + (cn.ly - pn.ly) * a
-        ry = pn.ry + (cn.ry - pn.ry) * a
-        bx = pn.bx + (cn.bx - pn.bx) * a
-        by = pn.by + (cn.by - pn.by) * a
-        return NetState(render_t, ly, ry, bx, by, cn.sl, cn.sr)
+        return self.state.snaps.sample(time.time())
 
     def _apply_window_position(self, role: str):
         if self._window_positioned:
@@ -266,11 +269,82 @@ class GameController:
         top.geometry(f"{w}x{h}+{x}+{y}")
         self._window_positioned = True
 
-    def _handle_line(self, line: str):
+    def _on_state(self, ns: NetState):
+        now = ns.rx
+        pn = self.state.snaps.latest
+        if not self.state.snaps.push(ns, now):
+            return
+
+        if self.state.role == "LEFT":
+            self._predict.on_state(ns.ly, ns.al, now)
+            self.net.input_acked(ns.al)
+        elif self.state.role == "RIGHT":
+            self._predict.on_state(ns.ry, ns.ar, now)
+            self.net.input_acked(ns.ar)
+
+        if pn is None:
+            return
+        try:
+            dx = ns.bx - pn.bx
+            dy = ns.by - pn.by
+            bounced = False
+            if self._prev_dx is not None and dx != 0 and (dx > 0) != (self._prev_dx > 0):
+                bounced = True
+            if self._prev_dy is not None and dy != 0 and (dy > 0) != (self._prev_dy > 0):
+                bounced = True
+            if dx != 0:
+                self._prev_dx = dx
+            if dy != 0:
+                self._prev_dy = dy
+            if bounced and self.game_view:
+                self.game_view.trigger_bounce_fx()
+        except Exception:
+            pass
+
+    def _on_lobby(self, line: str):
+        try:
+            op, ver, items = protocol.split_lobby(line)
+        except ValueError:
+            if line.split(" ", 1)[0] == "LOBBY" and self.game_view:
+                # unversioned: sent until PROTO is answered, and by older servers
+                self.game_view.set_lobby(parse_lobby(line[6:].split(";")))
+            return
+        if op == "LOBBY":
+            self._lobby_version = ver
+            if self.game_view:
+                self.game_view.set_lobby(parse_lobby(items))
+            return
+        if self._lobby_version is None:
+            return  # a snapshot is on its way
+        if ver != self._lobby_version + 1:
+            self._lobby_version = None
+            try:
+                self.net.send_line("LOBBY")
+            except Exception:
+                pass
+            return
+        self._lobby_version = ver
+        if not self.game_view:
+            return
+        if op == "LOBBY_DEL":
+            for name in items:
+                self.game_view.lobby_remove(name)
+        else:
+            for row in parse_lobby(items):
+                self.game_view.lobby_upsert(*row)
+
+    def _handle_line(self, line):
+        if isinstance(line, tuple):
+            return  # no other binary frames are sent to clients
+
         line = (line or "").strip()
         if not line:
             return
 
+        if line.startswith("PROTO "):
+            self.net.proto = line.split()[1]
+            return
+
         if line.startswith("ERROR"):
             err = line.split(maxsplit=1)[1].strip() if len(line.split(maxsplit=1)) > 1 else "UnknownError"
             if err == "NameTaken":
@@ -302,16 +376,14 @@ class GameController:
                 self.game_view.append_chat(msg)
             return
 
-        if line.startswith("LOBBY "):
-            items, statuses = parse_lobby(line[6:].strip())
-            if self.game_view:
-                self.game_view.set_lobby(items)
-                self.game_view.highlight_lobby(statuses)
+        if line.startswith("LOBBY"):
+            self._on_lobby(line)
             return
 
         if line.startswith("ROLE "):
             role = line.split(maxsplit=1)[1].strip()
             self.state.role = role
+            self._predict.reset()
             if self.game_view:
                 self.game_view.set_role(role)
                 self.game_view.append_log(f"Role: {role}")
@@ -321,6 +393,7 @@ class GameController:
         if line.startswith("MATCH "):
             ms = line.split(maxsplit=1)[1].strip()
             self.state.match_state = ms
+            self._predict.reset()
             if self.game_view:
                 self.game_view.set_match_state(ms)
                 try:
@@ -329,48 +402,6 @@ class GameController:
                     pass
             return
 
-        if line.startswith("STATE"):
-            kv = parse_kv(line)
-            try:
-                ns = NetState(
-                    time.time(),
-                    float(kv.get("ly", "0")),
-                    float(kv.get("ry", "0")),
-                    float(kv.get("bx", "0")),
-                    float(kv.get("by", "0")),
-                    int(kv.get("sl", "0")),
-                    int(kv.get("sr", "0")),
-                )
-            except Exception:
-                return
-
-            if self.state.curr_net is None:
-                self.state.prev_net = ns
-                self.state.curr_net = ns
-            else:
-                self.state.prev_net = self.state.curr_net
-                self.state.curr_net = ns
-
-            try:
-                pn = self.state.prev_net
-                cn = self.state.curr_net
-                dx = cn.bx - pn.bx
-                dy = cn.by - pn.by
-                bounced = False
-                if self._prev_dx is not None and dx != 0 and (dx > 0) != (self._prev_dx > 0):
-                    bounced = True
-                if self._prev_dy is not None and dy != 0 and (dy > 0) != (self._prev_dy > 0):
-                    bounced = True
-                if dx != 0:
-                    self._prev_dx = dx
-                if dy != 0:
-                    self._prev_dy = dy
-                if bounced and self.game_view:
-                    self.game_view.trigger_bounce_fx()
-            except Exception:
-                pass
-            return
-
         if line.startswith("END"):
             kv = parse_kv(line)
             winner = kv.get("winner", "?")
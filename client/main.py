@@ -7,6 +7,8 @@ import sys
 #   python -m client.main   (from pong_socket/)
 if __package__ is None:
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+# shared wire protocol lives in pong/ next to server.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import tkinter as tk
 from tkinter import ttk
@@ -1,47 +1,260 @@
 import socket
+import threading
+import time
+from collections import deque
 from typing import List
 
+from pong import protocol
+from pong.physics import DT
+from state.game_state import NetState
+
+# Snapshots from one read that are handed on. A burst only happens after a
+# stall, and by then anything older than this is behind the playout point.
+STATE_KEEP = 3
+
+UDP_BIND_TRIES = 10       # BIND datagrams sent before giving up on UDP
+UDP_BIND_INTERVAL = 0.2   # seconds between them
+UDP_KEEPALIVE = 1.0       # BIND resent this often once bound, for the server and any NAT
+
+_CLOSED = object()
+
+def _state_line(line: str, now: float):
+    kv = dict(p.split("=", 1) for p in line.split()[1:] if "=" in p)
+    try:
+        return NetState(int(kv["t"]) * DT, float(kv["ly"]), float(kv["ry"]),
+                        float(kv["bx"]), float(kv["by"]), int(kv["sl"]), int(kv["sr"]),
+                        int(kv.get("al", "0")), int(kv.get("ar", "0")), now)
+    except (KeyError, ValueError):
+        return None
+
 class ClientNet:
+    """Connection to the server, read by a background thread.
+
+    The thread blocks in recv(), splits and decodes everything that arrived
+    and answers bin2 deltas with ACK itself. Results go to ``inbox``, a
+    deque: append() and popleft() are atomic, so the Tk thread takes them
+    without a lock. Text lines arrive as str and snapshots as NetState,
+    stamped with the time they were read rather than the time Tk polled.
+
+    If the server offers UDP (pong/udp.py), a second thread binds the
+    datagram channel and from then on snapshots also arrive that way;
+    ``udp_bound`` says INPUT should go through ``send_input`` too.
+    """
+
     def __init__(self):
         self.sock: socket.socket | None = None
-        self.buf = bytearray()
+        self.proto = "text"  # STATE/INPUT framing the server accepted
+        self.inbox: deque = deque()
+        self._send_lock = threading.Lock()  # the receiver sends ACKs too
+        self.host = ""
+        self.udp: socket.socket | None = None
+        self.udp_bound = False
+        self._udp_token = 0
+        self._input = b""     # latest INPUT datagram, resent until acknowledged
+        self._input_seq = 0
+        self._input_acked = 0
+        self.udp_stale = 0    # snapshots that arrived after a newer one
 
     def connect(self, host: str, port: int) -> bool:
         self.close()
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((host, port))
-        s.setblocking(False)
         self.sock = s
+        self.host = host
+        self.inbox = deque()
+        threading.Thread(target=self._recv_loop, args=(s, self.inbox),
+                         name="client-net", daemon=True).start()
         return True
 
     def close(self):
         if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # wakes the receiver
+            except Exception:
+                pass
             try:
                 self.sock.close()
             except Exception:
                 pass
         self.sock = None
-        self.buf = bytearray()
+        self.proto = "text"
+        if self.udp:
+            try:
+                self.udp.close()  # wakes the datagram thread
+            except Exception:
+                pass
+        self.udp = None
+        self.udp_bound = False
+        self._input = b""
+        self._input_seq = self._input_acked = 0
 
     def send_line(self, line: str):
+        self.send_bytes(protocol.encode_line(line))
+
+    def send_bytes(self, data: bytes):
         if not self.sock:
             return
-        self.sock.sendall((line + "\n").encode("utf-8"))
+        with self._send_lock:
+            self.sock.sendall(data)
 
-    def recv_lines(self) -> List[str]:
-        if not self.sock:
-            return []
-        out: List[str] = []
+    def send_input(self, up: int, down: int, seq: int):
+        """INPUT as a datagram; only once ``udp_bound``."""
+        self._input = protocol.encode_datagram(self._udp_token, protocol.encode_input(up, down, seq))
+        self._input_seq = seq
+        self._send_udp(self._input)
+
+    def input_acked(self, seq: int):
+        """The server applied inputs up to ``seq`` (from a snapshot's al/ar)."""
+        if seq > self._input_acked:
+            self._input_acked = seq
+
+    def _send_udp(self, data: bytes):
         try:
-            data = self.sock.recv(4096)
-            if not data:
+            self.udp.send(data)
+        except (OSError, AttributeError):
+            pass  # lost like any datagram; AttributeError once closed
+
+    def poll(self) -> List:
+        """Everything received since the last call, oldest first.
+
+        Raises ConnectionError once the connection has closed and every
+        message before the close has been returned.
+        """
+        inbox = self.inbox
+        out = []
+        while inbox:
+            item = inbox.popleft()
+            if item is _CLOSED:
+                if out:
+                    inbox.appendleft(item)  # report it on the next poll
+                    break
                 raise ConnectionError("closed")
-            self.buf.extend(data)
-            while b"\n" in self.buf:
-                i = self.buf.index(b"\n")
-                raw = self.buf[:i]
-                del self.buf[:i+1]
-                out.append(raw.decode("utf-8", errors="ignore").strip())
-        except BlockingIOError:
-            pass
+            out.append(item)
         return out
+
+    def _recv_loop(self, sock: socket.socket, inbox: deque):
+        framer = protocol.Framer(protocol.MAX_SERVER_LINE)
+        snaps: dict[int, tuple] = {}  # recent bin2 snapshots by tick (delta baselines)
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                now = time.time()
+                states = []
+                ack = 0
+                for msg in framer.feed(data):
+                    ns = None
+                    if isinstance(msg, str):
+                        if msg.startswith("STATE "):
+                            ns = _state_line(msg, now)
+                            if ns is None:
+                                continue
+                        elif msg == "UDP OFF":
+                            self.udp_bound = False  # server heard nothing lately; bind again
+                            continue
+                        elif msg.startswith("UDP "):
+                            self._start_udp(msg)
+                            continue
+                    else:
+                        kind, payload = msg
+                        try:
+                            if kind == protocol.T_STATE:
+                                tick, ly, ry, bx, by, sl, sr, al, ar = protocol.decode_state(payload)
+                                ns = NetState(tick * DT, ly, ry, bx, by, sl, sr, al, ar, now)
+                            elif kind == protocol.T_DELTA:
+                                res = protocol.decode_delta(payload, snaps)
+                                if res is None:
+                                    continue
+                                tick, snap = res
+                                snaps[tick] = snap
+                                if len(snaps) > 64:
+                                    del snaps[next(iter(snaps))]
+                                ack = tick
+                                ly, ry, bx, by, sl, sr = protocol.dequantize(snap)
+                                ns = NetState(tick * DT, ly, ry, bx, by, sl, sr, snap[6], snap[7], now)
+                        except Exception:
+                            continue
+                    if ns is not None:
+                        states.append(ns)
+                        continue
+                    if states:
+                        # keep snapshots in order with the control lines around them
+                        inbox.extend(states[-STATE_KEEP:])
+                        states = []
+                    inbox.append(msg)
+                inbox.extend(states[-STATE_KEEP:])
+                if ack:
+                    with self._send_lock:
+                        sock.sendall(protocol.encode_ack(ack))
+        except (OSError, protocol.ProtocolError):
+            pass
+        finally:
+            inbox.append(_CLOSED)
+
+    def _start_udp(self, line: str):
+        if self.udp is not None:
+            return
+        try:
+            _, port, token = line.split()
+            u = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            u.connect((self.host, int(port)))
+        except (ValueError, OSError):
+            return
+        self.udp = u
+        self._udp_token = int(token)
+        threading.Thread(target=self._udp_loop, args=(u, self.inbox),
+                         name="client-udp", daemon=True).start()
+
+    def _udp_loop(self, u: socket.socket, inbox: deque):
+        bind = protocol.encode_datagram(self._udp_token, protocol.frame(protocol.T_BIND, b""))
+        last_tick = -1
+        try:
+            while self.udp is u:
+                if not self._bind(u, bind):
+                    return  # nothing comes back; stay on TCP
+                if self.udp is not u:
+                    return
+                self.udp_bound = True
+                self.send_line("UDP_READY")
+                u.settimeout(UDP_KEEPALIVE)  # also to notice close() when nothing arrives
+                sent = time.monotonic()
+                while self.udp is u and self.udp_bound:
+                    if time.monotonic() - sent >= UDP_KEEPALIVE:
+                        u.send(bind)
+                        sent = time.monotonic()
+                    try:
+                        data = u.recv(2048)
+                    except socket.timeout:
+                        continue
+                    if len(data) < protocol.FRAME_HDR.size:
+                        continue
+                    kind, _ = protocol.FRAME_HDR.unpack_from(data)
+                    if kind != protocol.T_STATE:
+                        continue
+                    try:
+                        tick, ly, ry, bx, by, sl, sr, al, ar = protocol.decode_state(data[protocol.FRAME_HDR.size:])
+                    except Exception:
+                        continue
+                    if tick <= last_tick:
+                        self.udp_stale += 1  # reordered, or a repeat we already have
+                        continue
+                    last_tick = tick
+                    inbox.append(NetState(tick * DT, ly, ry, bx, by, sl, sr, al, ar, time.time()))
+                    if self._input_seq > self._input_acked:
+                        self._send_udp(self._input)
+        except OSError:
+            pass
+
+    def _bind(self, u: socket.socket, bind: bytes) -> bool:
+        """Send BIND until the server answers with one."""
+        u.settimeout(UDP_BIND_INTERVAL)
+        for _ in range(UDP_BIND_TRIES):
+            u.send(bind)
+            try:
+                while u.recv(2048)[:1] != bytes((protocol.T_BIND,)):
+                    pass  # snapshots still in flight
+                return True
+            except socket.timeout:
+                continue
+        return False
@@ -1,16 +1,119 @@
 from __future__ import annotations
+from collections import deque
 from dataclasses import dataclass
 from typing import Optional
 
 @dataclass
 class NetState:
-    t: float
+    t: float  # server time: the snapshot's tick * DT
     ly: float
     ry: float
     bx: float
     by: float
     sl: int
     sr: int
+    al: int = 0  # last INPUT seq the server applied for each paddle
+    ar: int = 0
+    rx: float = 0.0  # local time the snapshot was read off the socket
+
+class SnapshotBuffer:
+    """Recent snapshots on the server's clock, played back a little late.
+
+    Arrival time minus server time is network delay plus a constant clock
+    offset; its minimum over a sliding window is the offset as seen by the
+    fastest packet. How much later than that each snapshot arrives is the
+    jitter, and the playout delay covers it plus one snapshot interval so
+    the render time is almost always bracketed by two snapshots.
+    """
+
+    SIZE = 32
+    WINDOW = 2.0           # seconds of arrivals the offset is the minimum of
+    JITTER_DECAY = 0.98    # per snapshot; a spike is forgotten within ~1 s
+    MARGIN = 0.020          # snapshots reach the buffer on the next 16 ms Tk poll
+    MAX_DELAY = 0.25
+    SLOW_DOWN = 0.5        # playout clock rate limits while the delay moves
+    SPEED_UP = 0.05
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.snaps: deque[NetState] = deque(maxlen=self.SIZE)
+        self._lags: deque[tuple[float, float]] = deque()  # (arrival, lag), lags increasing
+        self.offset = 0.0
+        self.jitter = 0.0
+        self.interval = 0.0
+        self.delay = 0.0  # current playout delay beyond the offset
+        self._lag: Optional[float] = None
+        self._now = 0.0
+
+    @property
+    def latest(self) -> Optional[NetState]:
+        return self.snaps[-1] if self.snaps else None
+
+    def push(self, ns: NetState, now: float) -> bool:
+        """Add a snapshot that arrived at ``now``; False if it was stale."""
+        last = self.latest
+        if last is not None:
+            if ns.t <= last.t:
+                if ns.t > last.t - 1.0:
+                    return False  # duplicate or reordered
+                self.clear()  # the server's clock went back: new server
+                last = None
+            else:
+                gap = min(ns.t - last.t, 0.1)  # unchanged snapshots are not sent
+                self.interval += (gap - self.interval) * (0.1 if self.interval else 1.0)
+        self.snaps.append(ns)
+
+        lag = now - ns.t
+        lags = self._lags
+        while lags and lags[-1][1] >= lag:
+            lags.pop()
+        lags.append((now, lag))
+        while lags[0][0] < now - self.WINDOW:
+            lags.popleft()
+        self.offset = lags[0][1]
+        self.jitter = max(lag - self.offset, self.jitter * self.JITTER_DECAY)
+        if self._lag is None:
+            self._lag = lag
+            self._now = now
+        return True
+
+    def target_delay(self) -> float:
+        return min(self.interval + self.jitter + self.MARGIN, self.MAX_DELAY)
+
+    def sample(self, now: float) -> Optional[NetState]:
+        """Interpolated state at ``now`` minus offset and playout delay."""
+        if self._lag is None:
+            return None
+        # Move the playout point toward its target by stretching or
+        # squeezing the render clock, never by jumping it.
+        dt = max(0.0, now - self._now)
+        self._now = now
+        target = self.offset + self.target_delay()
+        if target > self._lag:
+            self._lag = min(target, self._lag + dt * self.SLOW_DOWN)
+        else:
+            self._lag = max(target, self._lag - dt * self.SPEED_UP)
+        self.delay = self._lag - self.offset
+
+        t = now - self._lag
+        snaps = self.snaps
+        newest = snaps[-1]
+        if t >= newest.t:
+            return newest
+        for i in range(len(snaps) - 2, -1, -1):
+            pn = snaps[i]
+            if pn.t <= t:
+                cn = snaps[i + 1]
+                a = (t - pn.t) / (cn.t - pn.t)
+                return NetState(t,
+                                pn.ly + (cn.ly - pn.ly) * a,
+                                pn.ry + (cn.ry - pn.ry) * a,
+                                pn.bx + (cn.bx - pn.bx) * a,
+                                pn.by + (cn.by - pn.by) * a,
+                                cn.sl, cn.sr)
+        return snaps[0]
 
 class GameState:
     def __init__(self):
@@ -20,5 +123,4 @@ class GameState:
         self.sl: int = 0
         self.sr: int = 0
 
-        self.prev_net: Optional[NetState] = None
-        self.curr_net: Optional[NetState] = None
+        self.snaps = SnapshotBuffer()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import time
+
+from pong.physics import HEIGHT, PADDLE_H, PADDLE_SPEED
+
+PADDLE_MAX_Y = HEIGHT - PADDLE_H
+
+def _clamp(y: float) -> float:
+    return 0.0 if y < 0 else PADDLE_MAX_Y if y > PADDLE_MAX_Y else y
+
+class PaddlePredictor:
+    """Moves our own paddle the moment a key changes.
+
+    Every input gets a sequence number and STATE echoes the last one the
+    server applied. Once the server has seen our latest key, its paddle is
+    the truth: a small difference is blended away, a large one is snapped
+    to. While the paddle is moving the snapshot's age is unknown, so only
+    large errors are corrected then; the rest settles when it stops.
+    """
+
+    SNAP_DIST = 60.0  # logical units; further off than this, jump
+    BLEND = 0.25      # share of the remaining error removed per frame
+    EPSILON = 0.5
+
+    def __init__(self):
+        self.seq = 0  # never rewinds: the server keeps the last seq it saw
+        self.dir = 0  # follows the keys, which a new match does not release
+        self.reset()
+
+    def reset(self):
+        self.y: float | None = None
+        self._t = 0.0
+        self._error = 0.0
+
+    def input(self, direction: int) -> int:
+        """Record a new paddle direction (down - up); returns its seq."""
+        self.advance(time.time())
+        self.dir = direction
+        self.seq += 1
+        return self.seq
+
+    def advance(self, now: float) -> float | None:
+        if self.y is None:
+            return None
+        dt = now - self._t
+        self._t = now
+        y = self.y + self.dir * PADDLE_SPEED * dt
+        if self._error:
+            step = self._error * self.BLEND
+            self._error -= step
+            y += step
+            if abs(self._error) < self.EPSILON:
+                self._error = 0.0
+        self.y = _clamp(y)
+        return self.y
+
+    def on_state(self, server_y: float, ack: int, now: float):
+        if self.y is None:
+            self.y = server_y
+            self._t = now
+            return
+        if ack < self.seq:
+            return  # the server has not seen our latest key yet
+        self.advance(now)
+        err = server_y - self.y
+        if abs(err) > self.SNAP_DIST:
+            self.y = server_y
+            self._error = 0.0
+        elif self.dir == 0:
+            self._error = err if abs(err) > self.EPSILON else 0.0
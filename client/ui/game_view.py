@@ -6,6 +6,8 @@ import time
 
 from .widgets import WIDTH, HEIGHT, LEFT_X, RIGHT_X
 
+LOBBY_COLORS = {"PLAYING": "#d1f7d1", "QUEUED": "#fff2cc"}
+
 def _try_beep():
     try:
         import winsound
@@ -33,6 +35,7 @@ class GameView(ttk.Frame):
 
         self.canvas = tk.Canvas(main, bg="#0b0f14", highlightthickness=0)
         self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
 
         side = ttk.Frame(main)
         side.grid(row=0, column=1, sticky="ns", padx=(12, 0))
@@ -73,6 +76,7 @@ class GameView(ttk.Frame):
         lobby_frame.columnconfigure(0, weight=1)
         self.lobby = tk.Listbox(lobby_frame, width=42, height=9, activestyle="none", bd=0, highlightthickness=0)
         self.lobby.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
+        self._lobby_names: list[str] = []  # player on each Listbox row
 
         chat_frame = ttk.LabelFrame(side, text="Chat")
         chat_frame.grid(row=5, column=0, sticky="nsew", pady=(0, 10))
@@ -109,6 +113,12 @@ class GameView(ttk.Frame):
         self._shake_amp = 0
         self._last_beep_t = 0.0
 
+        # The scene is built once; frames only move the paddles and ball.
+        self._layout = None  # (pad_x, pad_y, scale) from the last <Configure>
+        self._shift = (0, 0)  # shake offset currently applied to the "static" items
+        self._drawn = {}  # item -> coords last given to Tk
+        self._build_scene()
+
     def set_play_again_callback(self, cb):
         self._play_again_cb = cb
 
@@ -130,6 +140,7 @@ class GameView(ttk.Frame):
     def set_role(self, role: str):
         self.lbl_role.config(text=f"Role: {role}")
         self._control_enabled = (role in ("LEFT", "RIGHT"))
+        self.canvas.itemconfigure(self._spectator_text, state="hidden" if self._control_enabled else "normal")
 
     def set_match_state(self, ms: str):
         self.lbl_status.config(text=f"Match: {ms}")
@@ -153,25 +164,39 @@ class GameView(ttk.Frame):
                     pass
             self._last_beep_t = now
 
-    def highlight_lobby(self, statuses: list[str]):
-        for i in range(self.lobby.size()):
-            try:
-                self.lobby.itemconfig(i, bg="white", fg="black")
-            except Exception:
-                pass
-        for i, st in enumerate(statuses):
-            st = (st or "").upper()
-            if st == "PLAYING":
-                self.lobby.itemconfig(i, bg="#d1f7d1", fg="black")
-            elif st == "QUEUED":
-                self.lobby.itemconfig(i, bg="#fff2cc", fg="black")
-            else:
-                self.lobby.itemconfig(i, bg="white", fg="black")
-
-    def set_lobby(self, items: list[str]):
+    def set_lobby(self, rows: list[tuple[str, str, str]]):
         self.lobby.delete(0, "end")
-        for it in items:
-            self.lobby.insert("end", it)
+        self._lobby_names = []
+        for name, text, status in rows:
+            self._lobby_insert("end", name, text, status)
+
+    def lobby_upsert(self, name: str, text: str, status: str):
+        try:
+            i = self._lobby_names.index(name)
+        except ValueError:
+            self._lobby_insert("end", name, text, status)
+            return
+        self.lobby.delete(i)
+        del self._lobby_names[i]
+        self._lobby_insert(i, name, text, status)
+
+    def lobby_remove(self, name: str):
+        try:
+            i = self._lobby_names.index(name)
+        except ValueError:
+            return
+        self.lobby.delete(i)
+        del self._lobby_names[i]
+
+    def _lobby_insert(self, i, name: str, text: str, status: str):
+        self.lobby.insert(i, text)
+        if i == "end":
+            self._lobby_names.append(name)
+            i = len(self._lobby_names) - 1
+        else:
+            self._lobby_names.insert(i, name)
+        bg = LOBBY_COLORS.get((status or "").upper(), "white")
+        self.lobby.itemconfig(i, bg=bg, fg="black")
 
     def append_log(self, text: str):
         self.log.configure(state="normal")
@@ -192,53 +217,70 @@ class GameView(ttk.Frame):
         self.chat_var.set("")
         self.on_send_chat(msg)
 
-    def render(self):
+    def _build_scene(self):
         c = self.canvas
-        c.delete("all")
-
-        cw = max(1, int(c.winfo_width()))
-        ch = max(1, int(c.winfo_height()))
-
-        ox = oy = 0
-        if time.time() < self._shake_until and self._shake_amp > 0:
-            ox = random.randint(-self._shake_amp, self._shake_amp)
-            oy = random.randint(-self._shake_amp, self._shake_amp)
-
-        sx = cw / WIDTH
-        sy = ch / HEIGHT
-        s = sx if sx < sy else sy
-
+        self._bg = c.create_rectangle(0, 0, 0, 0, outline="", fill="#0b0f14", tags="static")
+        self._center_line = []
+        y = 10
+        while y < HEIGHT:
+            self._center_line.append((y, c.create_rectangle(0, 0, 0, 0, fill="#2a3441", outline="", tags="static")))
+            y += 18 + 14
+        self._left_paddle = c.create_rectangle(0, 0, 0, 0, fill="#e8edf2", outline="#e8edf2")
+        self._right_paddle = c.create_rectangle(0, 0, 0, 0, fill="#e8edf2", outline="#e8edf2")
+        self._ball = c.create_oval(0, 0, 0, 0, fill="#e8edf2", outline="#e8edf2")
+        self._spectator_text = c.create_text(0, 0, fill="#e8edf2",
+                                             text="SPECTATOR MODE (Request to play to join queue)",
+                                             font=("Segoe UI", 12, "bold"), tags="static")
+
+    def _on_canvas_configure(self, event):
+        cw = max(1, int(event.width))
+        ch = max(1, int(event.height))
+        s = min(cw / WIDTH, ch / HEIGHT)
         draw_w = int(WIDTH * s)
         draw_h = int(HEIGHT * s)
         pad_x = (cw - draw_w) // 2
         pad_y = (ch - draw_h) // 2
+        self._layout = (pad_x, pad_y, s)
+        self._shift = (0, 0)
+        self._drawn.clear()
 
-        def tx(x): return pad_x + int((x + ox) * s)
-        def ty(y): return pad_y + int((y + oy) * s)
+        def tx(x): return pad_x + int(x * s)
+        def ty(y): return pad_y + int(y * s)
 
-        c.create_rectangle(pad_x, pad_y, pad_x + draw_w, pad_y + draw_h, outline="", fill="#0b0f14")
+        c = self.canvas
+        c.coords(self._bg, pad_x, pad_y, pad_x + draw_w, pad_y + draw_h)
+        cx = tx(WIDTH / 2)
+        half = max(1, int(1 * s))
+        for y, item in self._center_line:
+            c.coords(item, cx - half, ty(y), cx + half, ty(y + 18))
+        c.coords(self._spectator_text, cx, ty(20))
+        self.render()
+
+    def _place(self, item, *xy):
+        if self._drawn.get(item) != xy:
+            self.canvas.coords(item, *xy)
+            self._drawn[item] = xy
 
-        cx = WIDTH / 2
-        seg_h = 18
-        gap = 14
-        y = 10
-        while y < HEIGHT:
-            c.create_rectangle(tx(cx) - max(1, int(1*s)), ty(y), tx(cx) + max(1, int(1*s)), ty(y + seg_h),
-                               fill="#2a3441", outline="")
-            y += seg_h + gap
-
-        c.create_rectangle(tx(LEFT_X), ty(self._ly), tx(LEFT_X + 12), ty(self._ly + 90),
-                           fill="#e8edf2", outline="#e8edf2")
-        c.create_rectangle(tx(RIGHT_X), ty(self._ry), tx(RIGHT_X + 12), ty(self._ry + 90),
-                           fill="#e8edf2", outline="#e8edf2")
-        r = 8
-        c.create_oval(tx(self._bx - r), ty(self._by - r), tx(self._bx + r), ty(self._by + r),
-                      fill="#e8edf2", outline="#e8edf2")
+    def render(self):
+        if self._layout is None:
+            return
+        pad_x, pad_y, s = self._layout
 
-        if not self._control_enabled:
-            c.create_text(tx(WIDTH/2), ty(20), fill="#e8edf2",
-                          text="SPECTATOR MODE (Request to play to join queue)",
-                          font=("Segoe UI", 12, "bold"))
+        px = py = 0
+        if time.time() < self._shake_until and self._shake_amp > 0:
+            px = int(random.randint(-self._shake_amp, self._shake_amp) * s)
+            py = int(random.randint(-self._shake_amp, self._shake_amp) * s)
+        if (px, py) != self._shift:
+            self.canvas.move("static", px - self._shift[0], py - self._shift[1])
+            self._shift = (px, py)
+
+        def tx(x): return pad_x + px + int(x * s)
+        def ty(y): return pad_y + py + int(y * s)
+
+        self._place(self._left_paddle, tx(LEFT_X), ty(self._ly), tx(LEFT_X + 12), ty(self._ly + 90))
+        self._place(self._right_paddle, tx(RIGHT_X), ty(self._ry), tx(RIGHT_X + 12), ty(self._ry + 90))
+        r = 8
+        self._place(self._ball, tx(self._bx - r), ty(self._by - r), tx(self._bx + r), ty(self._by + r))
 
     def _on_key_press(self, event):
         if not self._control_enabled:
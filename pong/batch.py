@@ -0,0 +1,133 @@
+"""Vectorized stepping of many matches at once (optional, needs NumPy).
+
+Every match occupies one slot in structure-of-arrays buffers and a tick
+applies paddle integration, wall bounces, paddle hits and goals to all
+playing slots with masked array operations. The arithmetic mirrors
+MatchSim.step operation for operation, so given the same serves the
+results are bit-identical.
+"""
+from __future__ import annotations
+
+import random
+from typing import Callable
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from pong.physics import (
+    WIDTH, HEIGHT, PADDLE_H, PADDLE_W, PADDLE_MARGIN, PADDLE_SPEED,
+    BALL_R, BALL_SPEED, WIN_SCORE, GOAL_OVERSHOOT, serve_velocity,
+)
+
+LX = PADDLE_MARGIN
+RX = WIDTH - PADDLE_MARGIN - PADDLE_W
+
+
+class BatchPhysics:
+    def __init__(self, capacity: int, serve: Callable[[int], tuple[float, float]] | None = None):
+        if np is None:
+            raise RuntimeError("BatchPhysics needs numpy (pip install numpy)")
+        self.capacity = capacity
+        # serve(slot) -> (vx, vy) after a goal; the server passes each room's MatchSim.serve
+        if serve is None:
+            rng = random.Random()
+            serve = lambda slot: serve_velocity(rng)
+        self.serve = serve
+
+        f = lambda: np.zeros(capacity, dtype=np.float64)
+        self.ly, self.ry, self.bx, self.by, self.vx, self.vy = f(), f(), f(), f(), f(), f()
+        self.sl = np.zeros(capacity, dtype=np.int64)
+        self.sr = np.zeros(capacity, dtype=np.int64)
+        # paddle inputs: down - up per side, in {-1, 0, 1}
+        self.dir_l = np.zeros(capacity, dtype=np.int64)
+        self.dir_r = np.zeros(capacity, dtype=np.int64)
+        self.playing = np.zeros(capacity, dtype=bool)
+
+    def load(self, slot: int, ly, ry, bx, by, vx, vy, sl, sr):
+        self.ly[slot], self.ry[slot] = ly, ry
+        self.bx[slot], self.by[slot] = bx, by
+        self.vx[slot], self.vy[slot] = vx, vy
+        self.sl[slot], self.sr[slot] = sl, sr
+        self.playing[slot] = True
+
+    def release(self, slot: int):
+        self.playing[slot] = False
+        self.dir_l[slot] = 0
+        self.dir_r[slot] = 0
+
+    def set_input(self, slot: int, right: bool, up: int, down: int):
+        (self.dir_r if right else self.dir_l)[slot] = down - up
+
+    def read(self, slot: int) -> tuple:
+        return (float(self.ly[slot]), float(self.ry[slot]), float(self.bx[slot]),
+                float(self.by[slot]), int(self.sl[slot]), int(self.sr[slot]))
+
+    def step(self, dt: float) -> list[tuple[int, str]]:
+        """Advance every playing slot by ``dt``; returns ``(slot, winner)`` for finished matches."""
+        idx = np.flatnonzero(self.playing)
+        if not idx.size:
+            return []
+
+        ly = self.ly[idx] + self.dir_l[idx] * PADDLE_SPEED * dt
+        ry = self.ry[idx] + self.dir_r[idx] * PADDLE_SPEED * dt
+        np.clip(ly, 0, HEIGHT - PADDLE_H, out=ly)
+        np.clip(ry, 0, HEIGHT - PADDLE_H, out=ry)
+
+        vx = self.vx[idx]
+        vy = self.vy[idx]
+        bx = self.bx[idx] + vx * dt
+        by = self.by[idx] + vy * dt
+
+        top = by - BALL_R <= 0
+        bottom = ~top & (by + BALL_R >= HEIGHT)
+        by[top] = BALL_R
+        by[bottom] = HEIGHT - BALL_R
+        vy[top | bottom] *= -1
+
+        hit = (vx < 0) & (bx - BALL_R <= LX + PADDLE_W) & (ly <= by) & (by <= ly + PADDLE_H)
+        bx[hit] = LX + PADDLE_W + BALL_R
+        vx[hit] *= -1
+        vy[hit] = BALL_SPEED * 0.65 * ((by[hit] - (ly[hit] + PADDLE_H/2)) / (PADDLE_H/2))
+
+        hit = (vx > 0) & (bx + BALL_R >= RX) & (ry <= by) & (by <= ry + PADDLE_H)
+        bx[hit] = RX - BALL_R
+        vx[hit] *= -1
+        vy[hit] = BALL_SPEED * 0.65 * ((by[hit] - (ry[hit] + PADDLE_H/2)) / (PADDLE_H/2))
+
+        self.ly[idx], self.ry[idx] = ly, ry
+        self.bx[idx], self.by[idx] = bx, by
+        self.vx[idx], self.vy[idx] = vx, vy
+
+        goal_r = bx < -GOAL_OVERSHOOT
+        goal_l = ~goal_r & (bx > WIDTH + GOAL_OVERSHOOT)
+        if not (goal_r.any() or goal_l.any()):
+            return []
+
+        # goals are rare; handle them per slot like _step_room does
+        ended = []
+        for slot in idx[goal_r].tolist():
+            self.sr[slot] += 1
+            if self.sr[slot] >= WIN_SCORE:
+                self.playing[slot] = False
+                ended.append((slot, "RIGHT"))
+            else:
+                self._reset(slot, toward_right=True)
+        for slot in idx[goal_l].tolist():
+            self.sl[slot] += 1
+            if self.sl[slot] >= WIN_SCORE:
+                self.playing[slot] = False
+                ended.append((slot, "LEFT"))
+            else:
+                self._reset(slot, toward_right=False)
+        return ended
+
+    def _reset(self, slot: int, toward_right: bool):
+        self.ly[slot] = HEIGHT/2 - PADDLE_H/2
+        self.ry[slot] = HEIGHT/2 - PADDLE_H/2
+        self.bx[slot] = WIDTH/2
+        self.by[slot] = HEIGHT/2
+        vx, vy = self.serve(slot)
+        self.vx[slot] = abs(vx) if toward_right else -abs(vx)
+        self.vy[slot] = vy
@@ -0,0 +1,281 @@
+"""Client connections and the loop plumbing shared by server.py and relay.py.
+
+Both processes serve their clients from one selector loop and write to
+them the same way: every message is queued on the client's Conn, which
+sheds stale snapshots under backpressure, and the loop flushes queues
+without blocking. ConnLoop holds the accept/drop/watch/fan-out/flush
+methods for that. The game server and the relay subclass it and keep
+only what differs: what a newcomer is sent, what leaving means, and what
+happens when a viewer switches rooms.
+"""
+from __future__ import annotations
+
+import selectors
+import socket
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import islice
+
+from pong import protocol
+from pong.matchmaking import DEFAULT_RATING
+from pong.metrics import Metrics
+
+# per-connection outbound queue
+OUT_HIGH_WATER = 64 * 1024   # above this, queued STATE frames are shed
+OUT_HARD_LIMIT = 256 * 1024  # above this (after shedding) the client is cut off
+OUT_IOV_MAX = 256            # buffers handed to one sendmsg() call
+
+# chat: messages are fanned out once per tick as one multi-line write
+CHAT_RATE = 1.0     # messages per second per user, refilled continuously
+CHAT_BURST = 5      # token bucket size
+CHAT_HISTORY = 50   # recent lines replayed to newcomers
+
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+class SlowConsumer(ConnectionError):
+    pass
+
+@dataclass(eq=False)
+class Conn:
+    sock: socket.socket
+    addr: tuple
+    name: str = ""
+    role: str = "SPECTATOR"   # LEFT/RIGHT/SPECTATOR
+    status: str = "WAITING"   # WAITING/QUEUED/PLAYING
+    up: int = 0
+    down: int = 0
+    framer: protocol.Framer = field(default_factory=protocol.Framer)
+    room: object = None       # room played in or watched (server Room or RelayRoom)
+    proto: str = "text"       # negotiated STATE/INPUT framing: text/bin1/bin2
+    acked: int = 0            # last snapshot tick acknowledged (bin2 baseline)
+    watch_tick: int = 0       # tick the current room was joined; older ACKs are stale
+    input_seq: int = 0        # last INPUT seq applied; echoed in STATE for client prediction
+    rating: float = DEFAULT_RATING  # used by --matchmaker rating
+    chat_tokens: float = CHAT_BURST
+    chat_at: float = 0.0        # last token refill
+    next_input: tuple | None = None  # (up, down, seq) applied at the next tick
+    cmd_tick: int = -1          # tick ``cmds`` counts for
+    cmds: int = 0
+    flood_tick: int = -1        # last tick the budget was exceeded
+    flood_ticks: int = 0        # consecutive ticks it was exceeded
+    paused: bool = False        # over budget; not read again until the next tick
+    held: list | None = None    # --workers: messages after a HELLO whose name claim is pending
+    udp_token: int = 0          # --udp-port session token, once asked for
+    udp_addr: tuple | None = None  # where the token's BIND came from
+    udp: bool = False           # UDP_READY: snapshots go out as datagrams
+    udp_seen: float = 0.0       # last datagram from udp_addr (clients send BIND keepalives)
+
+    # outbound queue of (payload, stream); written by flush() once per tick.
+    # stream is None for data that must arrive, else whose snapshot it is
+    out: deque = field(default_factory=deque)
+    out_bytes: int = 0
+    pending: set | None = None  # the loop's set of conns with queued output
+    want_write: bool = False    # registered for EVENT_WRITE
+    dead: bool = False          # hit OUT_HARD_LIMIT; dropped at the next flush
+    states_shed: int = 0
+    relay: bool = False         # downstream relay.py: gets every room, tagged ROOM <rid>
+    lobby: bool = False         # negotiated LOBBY_DELTAS; others get whole unversioned LOBBY lines
+    metrics: Metrics | None = None  # process-wide counters
+
+    def send_line(self, line: str):
+        data = protocol.encode_line(line)
+        if self.metrics is not None:
+            self.metrics.counters["bytes_encoded"] += len(data)
+            self.metrics.count_out(line.split(" ", 1)[0], len(data))
+        self._enqueue(data, None)
+
+    def send_bytes(self, data: bytes, droppable: bool = False, stream: int = 0):
+        # a droppable snapshot is superseded by the next one of the same stream
+        # (a room, for relays that carry them all)
+        self._enqueue(data, stream if droppable else None)
+
+    def _enqueue(self, data, stream):
+        if self.dead:
+            raise SlowConsumer(self.addr)
+        self.out.append((data, stream))
+        self.out_bytes += len(data)
+        if self.pending is not None:
+            self.pending.add(self)
+        if self.out_bytes > OUT_HIGH_WATER:
+            self._shed()
+            if self.out_bytes > OUT_HARD_LIMIT:
+                self.dead = True
+                if self.metrics is not None:
+                    self.metrics.counters["slow_consumers"] += 1
+                raise SlowConsumer(self.addr)
+
+    def _shed(self):
+        # keep control messages and each stream's newest snapshot; older ones are stale
+        newest = {}
+        for i, (_, stream) in enumerate(self.out):
+            if stream is not None:
+                newest[stream] = i
+        kept = deque()
+        shed = 0
+        for i, (data, stream) in enumerate(self.out):
+            if stream is not None and newest[stream] != i:
+                self.out_bytes -= len(data)
+                shed += 1
+                continue
+            kept.append((data, stream))
+        self.out = kept
+        self.states_shed += shed
+        if self.metrics is not None:
+            self.metrics.counters["states_shed"] += shed
+
+    def flush(self) -> bool:
+        """Write queued output without blocking; True once the queue is empty."""
+        while self.out:
+            bufs = [d for d, _ in islice(self.out, OUT_IOV_MAX)]
+            try:
+                if _HAS_SENDMSG:
+                    n = self.sock.sendmsg(bufs)
+                else:
+                    n = self.sock.send(b"".join(bufs))
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.out_bytes -= n
+            if self.metrics is not None:
+                self.metrics.counters["bytes_sent"] += n
+            while n:
+                data, _ = self.out[0]
+                if n >= len(data):
+                    self.out.popleft()
+                    n -= len(data)
+                else:
+                    # partially written: the remainder must go out as-is
+                    self.out[0] = (memoryview(data)[n:], None)
+                    return False
+        return True
+
+class ConnLoop:
+    """Accepting, watching, fanning out to and flushing Conns on one selector.
+
+    Subclasses set ``sel``, ``srv`` (the listener), ``conns`` (socket ->
+    Conn), ``rooms``, ``metrics``, ``counters``, ``_pending`` and
+    ``_relays``, and override the hooks: ``_greet`` for a new connection,
+    ``_dropped`` for one that is gone and ``_watched`` after a viewer
+    changed rooms. Rooms need ``viewers``, ``match_state``, ``active`` and
+    ``left`` (falsy while nobody plays in it, as in a replay).
+    """
+
+    LOG = "SERVER"  # prefix of printed messages
+
+    def _accept(self):
+        # drain the backlog; a listener that is readable may hold many clients
+        while True:
+            try:
+                cs, addr = self.srv.accept()
+            except OSError:
+                return
+            cs.setblocking(False)
+            cs.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            c = Conn(sock=cs, addr=addr, pending=self._pending, metrics=self.metrics)
+            self.conns[cs] = c
+            self.sel.register(cs, selectors.EVENT_READ, c)
+            self._auto_watch(c)
+            self._greet(c)
+
+    def _greet(self, c: Conn):
+        pass
+
+    def _drop_conn(self, cs: socket.socket):
+        c = self.conns.pop(cs, None)
+        if not c:
+            return
+        try:
+            self.sel.unregister(cs)
+        except (KeyError, ValueError):
+            pass
+        self._pending.discard(c)
+        self._relays.discard(c)
+        self._dropped(c)
+        try:
+            cs.close()
+        except Exception:
+            pass
+
+    def _dropped(self, c: Conn):
+        self._watch(c, None)
+
+    def _watch(self, c: Conn, room):
+        if c.room is room:
+            return
+        old = c.room
+        if old is not None:
+            old.viewers.discard(c)
+        c.room = room
+        if room is not None:
+            room.viewers.add(c)
+        self._watched(c, old, room)
+
+    def _watched(self, c: Conn, old, room):
+        pass
+
+    def _auto_watch(self, c: Conn):
+        # spectators without an active room follow the first running match;
+        # replays (nobody playing) are only watched on request
+        if c.relay or (c.room is not None and c.room.active):
+            return
+        for room in self.rooms.values():
+            if room.active and room.left:
+                self._watch(c, room)
+                return
+        self._watch(c, None)
+
+    def _match_state_of(self, c: Conn) -> str:
+        return c.room.match_state if c.room else "WAITING"
+
+    def _encode(self, line: str) -> bytes:
+        data = protocol.encode_line(line)
+        self.counters["bytes_encoded"] += len(data)
+        return data
+
+    def _fanout(self, data: bytes, targets, droppable: bool = False, kind: str = "OTHER",
+                stream: int = 0):
+        # One immutable payload shared by every recipient's queue. Overflowing
+        # clients are only flagged dead here and dropped by _flush_all, so a
+        # burst of slow consumers cannot recurse through _drop_conn.
+        targets = list(targets)
+        for c in targets:
+            try:
+                c.send_bytes(data, droppable, stream)
+            except SlowConsumer:
+                pass
+        self.metrics.count_out(kind, len(data) * len(targets), len(targets))
+
+    def _flush(self, c: Conn):
+        if c.sock not in self.conns:
+            return
+        if c.dead:
+            print(f"[{self.LOG}] Dropping slow consumer: {c.addr}")
+            self._drop_conn(c.sock)
+            return
+        try:
+            done = c.flush()
+        except OSError:
+            self._drop_conn(c.sock)
+            return
+        if done:
+            self._pending.discard(c)
+        # only wait for writability while the kernel buffer is full
+        if done == c.want_write:
+            c.want_write = not done
+            self._set_events(c)
+
+    def _set_events(self, c: Conn):
+        reading = not c.paused and c.held is None
+        events = (selectors.EVENT_READ if reading else 0) | (selectors.EVENT_WRITE if c.want_write else 0)
+        try:
+            if not events:
+                self.sel.unregister(c.sock)
+            elif c.sock in self.sel.get_map():
+                self.sel.modify(c.sock, events, c)
+            else:
+                self.sel.register(c.sock, events, c)
+        except (KeyError, ValueError):
+            pass
+
+    def _flush_all(self):
+        for c in list(self._pending):
+            self._flush(c)
@@ -0,0 +1,159 @@
+"""Matchmaking queues.
+
+Both queues hold whatever the server queues (its Conn objects) and offer
+the same operations: ``add``, ``discard``, ``in``, ``len`` and
+``pop_pair(now)``. Membership is a dict lookup. Removal only forgets the
+player; the stale slot in the FIFO is skipped when it reaches the front
+and the FIFO is compacted once stale slots outnumber live ones.
+
+  MatchQueue      first come, first served
+  RatingMatcher   pairs players of similar rating; the window a player
+                  accepts widens the longer they wait
+"""
+from __future__ import annotations
+
+import time
+from collections import deque
+
+DEFAULT_RATING = 1000.0
+
+
+class MatchQueue:
+    """FIFO with an O(1) membership index and lazy removal."""
+
+    def __init__(self):
+        self._order: deque = deque()  # (ticket, player); stale once the ticket is gone
+        self._index: dict = {}        # player -> (ticket, enqueue time)
+        self._next = 0
+        self.retry_at = float("inf")  # pop_pair may pair more after this time
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, p) -> bool:
+        return p in self._index
+
+    def __iter__(self):
+        """Live players, longest waiting first."""
+        index = self._index
+        for ticket, p in self._order:
+            e = index.get(p)
+            if e is not None and e[0] == ticket:
+                yield p
+
+    def add(self, p, now: float | None = None) -> bool:
+        if p in self._index:
+            return False
+        self._next += 1
+        self._index[p] = (self._next, time.monotonic() if now is None else now)
+        self._order.append((self._next, p))
+        return True
+
+    def discard(self, p) -> bool:
+        if self._index.pop(p, None) is None:
+            return False
+        if len(self._order) > 2 * len(self._index) + 64:
+            self._order = deque((t, q) for t, q in self._order
+                                if q in self._index and self._index[q][0] == t)
+        return True
+
+    def waited(self, p, now: float) -> float:
+        return now - self._index[p][1]
+
+    def pop(self):
+        """Remove and return the longest-waiting player, or None."""
+        order, index = self._order, self._index
+        while order:
+            ticket, p = order.popleft()
+            e = index.get(p)
+            if e is not None and e[0] == ticket:
+                del index[p]
+                return p
+        return None
+
+    def pop_pair(self, now: float):
+        if len(self._index) < 2:
+            return None
+        return self.pop(), self.pop()
+
+
+class RatingMatcher(MatchQueue):
+    """Pairs the longest-waiting player with the oldest one close enough in rating.
+
+    Players are also filed in buckets of BUCKET points, so finding a partner
+    looks at the few buckets inside the window rather than the whole queue.
+    A player accepts opponents within TOLERANCE points, plus WIDEN points for
+    every second waited, up to MAX_TOLERANCE.
+    """
+
+    BUCKET = 50
+    TOLERANCE = 100.0
+    WIDEN = 25.0          # points per second waited
+    MAX_TOLERANCE = 800.0
+    RETRY = 1.0           # seconds between retries while the window widens
+
+    def __init__(self, rating=lambda p: DEFAULT_RATING):
+        super().__init__()
+        self.rating = rating
+        self._buckets: dict[int, MatchQueue] = {}
+        self._bucket_of: dict = {}  # player -> bucket it was filed in
+
+    def add(self, p, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        if not super().add(p, now):
+            return False
+        b = self._bucket_of[p] = int(self.rating(p) // self.BUCKET)
+        q = self._buckets.get(b)
+        if q is None:
+            q = self._buckets[b] = MatchQueue()
+        q.add(p, now)
+        return True
+
+    def discard(self, p) -> bool:
+        if not super().discard(p):
+            return False
+        b = self._bucket_of.pop(p)
+        q = self._buckets.get(b)
+        if q is not None:
+            q.discard(p)
+            if not q:
+                del self._buckets[b]
+        return True
+
+    def pop(self):
+        for p in self:
+            self.discard(p)
+            return p
+        return None
+
+    def tolerance(self, p, now: float) -> float:
+        return min(self.TOLERANCE + self.WIDEN * self.waited(p, now), self.MAX_TOLERANCE)
+
+    def pop_pair(self, now: float):
+        self.retry_at = float("inf")
+        if len(self) < 2:
+            return None
+        for p in self:
+            r = self.rating(p)
+            tol = self.tolerance(p, now)
+            best = None
+            best_ticket = 0
+            for b in range(int((r - tol) // self.BUCKET), int((r + tol) // self.BUCKET) + 1):
+                q = self._buckets.get(b)
+                if q is None:
+                    continue
+                for other in q:  # oldest first; stop at the first that fits
+                    if other is p or abs(self.rating(other) - r) > tol:
+                        continue
+                    ticket = self._index[other][0]
+                    if best is None or ticket < best_ticket:
+                        best, best_ticket = other, ticket
+                    break
+            if best is not None:
+                self.discard(p)
+                self.discard(best)
+                return p, best
+        # nobody fits yet; the windows grow with time
+        if self.MAX_TOLERANCE > self.TOLERANCE:
+            self.retry_at = now + self.RETRY
+        return None
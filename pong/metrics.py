@@ -0,0 +1,225 @@
+"""Runtime counters and latency histograms for the server loop.
+
+Everything here is updated from the single event-loop thread, so plain
+ints and lists are enough. The same numbers are rendered two ways: a
+one-line ``STATS`` reply for the text protocol, and the Prometheus text
+exposition format served by MetricsHTTP (``--metrics-port``).
+"""
+from __future__ import annotations
+
+import selectors
+import socket
+from bisect import bisect_left
+from typing import Callable
+
+# seconds; 1/60 is a bucket edge so "tick took longer than a tick" is exact
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                1 / 60, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+class Histogram:
+    __slots__ = ("name", "help", "bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, name: str, help: str, bounds=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.count += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (max for +Inf)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        # plain counters; Conn and the server bump these directly
+        self.counters: dict[str, int] = {
+            "bytes_encoded": 0,   # broadcasts are encoded once, so sent >> encoded
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "states_shed": 0,     # stale STATE frames dropped from slow queues
+            "slow_consumers": 0,  # connections cut off at OUT_HARD_LIMIT
+            "tick_overruns": 0,   # ticks that started more than one tick late
+            "tick_resets": 0,     # catch-up backlog abandoned (MAX_CATCHUP_STEPS)
+            "chat_limited": 0,    # CHAT messages refused by the per-user token bucket
+            "commands_dropped": 0,   # inbound commands over a connection's per-tick budget
+            "inputs_coalesced": 0,   # INPUTs/ACKs superseded by a later one before the step
+            "clients_throttled": 0,  # ticks a connection spent unread for exceeding its budget
+            "flood_disconnects": 0,  # connections over budget for FLOOD_TICKS in a row
+            "udp_stale": 0,          # INPUT datagrams older than what was already applied
+            "udp_fallbacks": 0,      # clients moved back to TCP after UDP_TIMEOUT of silence
+        }
+        # per command type: [messages, bytes]
+        self.msgs_in: dict[str, list[int]] = {}
+        self.msgs_out: dict[str, list[int]] = {}
+
+        self.step = Histogram("step_seconds", "Simulation step of all rooms, per tick")
+        self.tick = Histogram("tick_seconds", "Step + snapshot broadcast + flush, per tick")
+        self.lag = Histogram("loop_lag_seconds", "How late the loop started a due tick")
+        self.recv = Histogram("recv_seconds", "recv() and framing for one readable client")
+        self.broadcast = Histogram("broadcast_seconds", "Encoding and queueing STATE for all rooms")
+        self.flush = Histogram("flush_seconds", "Writing queued output to sockets, per tick")
+        self.histograms = (self.step, self.tick, self.lag, self.recv, self.broadcast, self.flush)
+
+        self.gauges: dict[str, tuple[str, Callable[[], float]]] = {}
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]):
+        self.gauges[name] = (help, fn)
+
+    def count_in(self, kind: str, nbytes: int):
+        e = self.msgs_in.get(kind)
+        if e is None:
+            e = self.msgs_in[kind] = [0, 0]
+        e[0] += 1
+        e[1] += nbytes
+
+    def count_out(self, kind: str, nbytes: int, n: int = 1):
+        """``n`` messages totalling ``nbytes`` were queued."""
+        e = self.msgs_out.get(kind)
+        if e is None:
+            e = self.msgs_out[kind] = [0, 0]
+        e[0] += n
+        e[1] += nbytes
+
+    def summary(self) -> str:
+        """key=value pairs for the STATS reply; times in milliseconds."""
+        parts = [f"{name}={fn():g}" for name, (_, fn) in self.gauges.items()]
+        parts += [f"{k}={v}" for k, v in self.counters.items()]
+        for h in self.histograms:
+            base = h.name[:-len("_seconds")]
+            parts.append(f"{base}_p50_ms={h.quantile(0.5) * 1000:.3f}")
+            parts.append(f"{base}_p99_ms={h.quantile(0.99) * 1000:.3f}")
+            parts.append(f"{base}_max_ms={h.max * 1000:.3f}")
+        for direction, table in (("in", self.msgs_in), ("out", self.msgs_out)):
+            for kind, (n, b) in sorted(table.items()):
+                parts.append(f"{direction}.{kind}={n}/{b}")
+        return " ".join(parts)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        out = []
+        for name, (help, fn) in self.gauges.items():
+            out.append(f"# HELP pong_{name} {help}\n# TYPE pong_{name} gauge\npong_{name} {fn():g}")
+        for k, v in self.counters.items():
+            out.append(f"# TYPE pong_{k}_total counter\npong_{k}_total {v}")
+        for direction, table in (("in", self.msgs_in), ("out", self.msgs_out)):
+            out.append(f"# TYPE pong_messages_{direction}_total counter")
+            out.extend(f'pong_messages_{direction}_total{{type="{k}"}} {n}' for k, (n, _) in sorted(table.items()))
+            out.append(f"# TYPE pong_message_bytes_{direction}_total counter")
+            out.extend(f'pong_message_bytes_{direction}_total{{type="{k}"}} {b}' for k, (_, b) in sorted(table.items()))
+        for h in self.histograms:
+            name = f"pong_{h.name}"
+            out.append(f"# HELP {name} {h.help}\n# TYPE {name} histogram")
+            seen = 0
+            for bound, n in zip(h.bounds, h.counts):
+                seen += n
+                out.append(f'{name}_bucket{{le="{bound:g}"}} {seen}')
+            out.append(f'{name}_bucket{{le="+Inf"}} {h.count}')
+            out.append(f"{name}_sum {h.sum:.6f}\n{name}_count {h.count}")
+        return "\n".join(out) + "\n"
+
+
+class MetricsHTTP:
+    """Answers ``GET /metrics`` on its own port from the server's selector.
+
+    Scrapes are tiny and rare, so each request is read, answered with
+    HTTP/1.0 and closed; nothing here blocks the game loop.
+    """
+
+    MAX_REQUEST = 8192
+
+    def __init__(self, sel: selectors.BaseSelector, host: str, port: int, render: Callable[[], str]):
+        self.sel = sel
+        self.render = render
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self._clients: dict[socket.socket, bytearray] = {}  # request bytes, then response bytes
+        self._writing: set[socket.socket] = set()
+        sel.register(self.sock, selectors.EVENT_READ, self)
+
+    def handle(self, sock: socket.socket, mask: int):
+        if sock is self.sock:
+            self._accept()
+            return
+        buf = self._clients.get(sock)
+        if buf is None:
+            return
+        try:
+            if mask & selectors.EVENT_READ and sock not in self._writing:
+                data = sock.recv(4096)
+                if not data:
+                    raise ConnectionError("closed")
+                buf.extend(data)
+                if b"\r\n\r\n" in buf or b"\n\n" in buf or len(buf) > self.MAX_REQUEST:
+                    self._respond(sock, buf)
+                return
+            if mask & selectors.EVENT_WRITE:
+                n = sock.send(buf)
+                del buf[:n]
+                if not buf:
+                    self._close(sock)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(sock)
+
+    def _accept(self):
+        while True:
+            try:
+                cs, _ = self.sock.accept()
+            except OSError:
+                return
+            cs.setblocking(False)
+            self._clients[cs] = bytearray()
+            self.sel.register(cs, selectors.EVENT_READ, self)
+
+    def _respond(self, sock: socket.socket, request: bytearray):
+        line = bytes(request.split(b"\n", 1)[0]).decode("latin-1").split()
+        if len(line) >= 2 and line[0] == "GET" and line[1].split("?", 1)[0] in ("/", "/metrics"):
+            status, body, ctype = "200 OK", self.render().encode(), "text/plain; version=0.0.4"
+        else:
+            status, body, ctype = "404 Not Found", b"not found\n", "text/plain"
+        head = (f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode()
+        request[:] = head + body
+        self._writing.add(sock)
+        self.sel.modify(sock, selectors.EVENT_WRITE, self)
+
+    def _close(self, sock: socket.socket):
+        self._clients.pop(sock, None)
+        self._writing.discard(sock)
+        try:
+            self.sel.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        for s in list(self._clients):
+            self._close(s)
+        self._close(self.sock)
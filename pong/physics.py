@@ -0,0 +1,31 @@
+"""Field geometry and physics constants shared by the server's steppers."""
+from __future__ import annotations
+
+import random
+
+TICK_HZ = 60
+DT = 1.0 / TICK_HZ
+
+# game field (logical units)
+WIDTH = 800
+HEIGHT = 500
+
+PADDLE_H = 90
+PADDLE_W = 12
+PADDLE_MARGIN = 24
+PADDLE_SPEED = 360.0  # units/s
+
+BALL_R = 8
+BALL_SPEED = 360.0
+
+WIN_SCORE = 7
+
+GOAL_OVERSHOOT = 30  # ball must travel this far past the edge to score
+
+
+def serve_velocity(rng: random.Random) -> tuple[float, float]:
+    """Ball velocity after a reset; serve side and angle come from ``rng``."""
+    sign = 1 if rng.getrandbits(1) else -1
+    vx = BALL_SPEED * sign
+    vy = BALL_SPEED * (0.15 + rng.randrange(30)/100.0) * sign
+    return vx, vy
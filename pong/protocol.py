@@ -0,0 +1,361 @@
+"""Wire format shared by the server and the Tk client.
+
+The control protocol is newline-terminated UTF-8 text ("HELLO bob",
+"LOBBY ...", "STATE t=.. ly=.."). During the HELLO exchange the client
+offers "PROTO bin2 bin1" and the server answers with the best level both
+sides know. That switches the hot STATE/INPUT messages to length-prefixed
+binary frames; everything else stays text.
+
+  bin1  full STATE frames with float32 positions
+  bin2  quantized delta snapshots against the last baseline the client
+        acknowledged with an ACK frame
+
+A frame starts with a type byte in 0xF5..0xFF. Those bytes never occur in
+UTF-8, so a text line can never be mistaken for a frame and both kinds can
+be interleaved on one stream.
+
+INPUT carries a sequence number ("INPUT UP 1 <seq>" or in the frame), and
+every snapshot echoes the last seq the server applied for each paddle
+(al/ar) so a player's client can reconcile its predicted paddle.
+
+With --udp-port the server also offers a datagram channel for the same
+frames; see pong/udp.py. Everything but STATE and INPUT stays on TCP.
+
+The lobby is versioned for clients that add "lobby1" (LOBBY_DELTAS) to
+their PROTO offer: they get one "LOBBY <ver> <items>" snapshot and then
+LOBBY_ADD/LOBBY_UPD/LOBBY_DEL lines, each one version later than the
+last; on a gap they send LOBBY to get a new snapshot. Everyone else keeps
+getting a whole "LOBBY <items>" line whenever the lobby changes.
+
+Every reader splits its stream with a Framer. Lines a server accepts from
+its peers are capped at MAX_LINE; parse_command() turns them into the
+message objects at the bottom of this module.
+"""
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import ClassVar
+
+PROTO_BIN = "bin1"
+PROTO_DELTA = "bin2"
+PROTOS = (PROTO_DELTA, PROTO_BIN)  # best first
+LOBBY_DELTAS = "lobby1"            # feature offered alongside the PROTO levels
+
+FRAME_HDR = struct.Struct("<BH")   # type, payload length
+T_STATE = 0xF5
+T_INPUT = 0xF6
+T_DELTA = 0xF7
+T_ACK = 0xF8
+T_BIND = 0xF9  # UDP only: ties a datagram address to a session token
+FRAME_NAMES = {T_STATE: "STATE", T_INPUT: "INPUT", T_DELTA: "DELTA", T_ACK: "ACK", T_BIND: "BIND"}
+
+STATE_FMT = struct.Struct("<I4f2B")  # tick, ly, ry, bx, by, sl, sr
+STATE_ACKS = struct.Struct("<II")    # follows STATE_FMT: input seq applied for left, right
+INPUT_FMT = struct.Struct("<BI")     # bit0 = UP, bit1 = DOWN; input seq
+SEQ_MAX = 0xFFFFFFFF                 # seqs travel as u32 (INPUT_FMT, STATE_ACKS)
+ACK_FMT = struct.Struct("<I")        # baseline tick
+UDP_TOKEN = struct.Struct("<Q")      # starts every client datagram
+
+# Quantized snapshot: (ly, ry, bx, by, sl, sr, al, ar) with positions in
+# 1/16 units; al/ar are the input acks and only travel when they change.
+POS_SCALE = 16
+SNAP_FIELDS = "hhhhBBII"
+DELTA_HDR = struct.Struct("<IIB")    # tick, baseline tick (0 = none), changed-field mask
+_delta_bodies: dict[int, struct.Struct] = {}
+
+MAX_LINE = 4096            # longest command line a server accepts
+MAX_SERVER_LINE = 1 << 20  # lines from a server; LOBBY grows with the lobby
+CHAT_MAX_LEN = 200         # characters of a CHAT message the server passes on
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def is_frame_type(b: int) -> bool:
+    return b >= 0xF5
+
+
+def frame(kind: int, payload: bytes) -> bytes:
+    return FRAME_HDR.pack(kind, len(payload)) + payload
+
+
+def encode_state(tick: int, ly: float, ry: float, bx: float, by: float, sl: int, sr: int,
+                 al: int = 0, ar: int = 0) -> bytes:
+    return frame(T_STATE, STATE_FMT.pack(tick & 0xFFFFFFFF, ly, ry, bx, by, sl, sr) + STATE_ACKS.pack(al, ar))
+
+
+def decode_state(payload: bytes) -> tuple:
+    """(tick, ly, ry, bx, by, sl, sr, al, ar); acks are 0 from older servers."""
+    st = STATE_FMT.unpack_from(payload)
+    if len(payload) < STATE_FMT.size + STATE_ACKS.size:
+        return st + (0, 0)
+    return st + STATE_ACKS.unpack_from(payload, STATE_FMT.size)
+
+
+def encode_input(up: int, down: int, seq: int = 0) -> bytes:
+    return frame(T_INPUT, INPUT_FMT.pack((1 if up else 0) | (2 if down else 0), seq))
+
+
+def decode_input(payload: bytes) -> tuple[int, int, int]:
+    """(up, down, seq); seq is 0 from clients that send the mask alone."""
+    if len(payload) < INPUT_FMT.size:
+        mask, seq = payload[0], 0
+    else:
+        mask, seq = INPUT_FMT.unpack(payload)
+    return mask & 1, (mask >> 1) & 1, seq
+
+
+def negotiate(offered) -> str:
+    for p in PROTOS:
+        if p in offered:
+            return p
+    return "text"
+
+
+def quantize(ly: float, ry: float, bx: float, by: float, sl: int, sr: int) -> tuple:
+    return (round(ly * POS_SCALE), round(ry * POS_SCALE),
+            round(bx * POS_SCALE), round(by * POS_SCALE), sl, sr)
+
+
+def dequantize(snap: tuple) -> tuple:
+    ly, ry, bx, by, sl, sr = snap[:6]
+    return ly / POS_SCALE, ry / POS_SCALE, bx / POS_SCALE, by / POS_SCALE, sl, sr
+
+
+def _delta_body(mask: int) -> struct.Struct:
+    st = _delta_bodies.get(mask)
+    if st is None:
+        st = struct.Struct("<" + "".join(f for i, f in enumerate(SNAP_FIELDS) if mask >> i & 1))
+        _delta_bodies[mask] = st
+    return st
+
+
+def encode_delta(tick: int, base_tick: int, base: tuple | None, snap: tuple) -> bytes:
+    """Frame ``snap`` as the fields that differ from ``base`` (all of them without one)."""
+    mask = 0
+    vals = []
+    for i, v in enumerate(snap):
+        if base is None or base[i] != v:
+            mask |= 1 << i
+            vals.append(v)
+    payload = DELTA_HDR.pack(tick, base_tick if base is not None else 0, mask) + _delta_body(mask).pack(*vals)
+    return frame(T_DELTA, payload)
+
+
+def decode_delta(payload: bytes, baselines: dict) -> tuple[int, tuple] | None:
+    """Rebuild ``(tick, snap)``; None if the baseline is not in ``baselines``."""
+    tick, base_tick, mask = DELTA_HDR.unpack_from(payload)
+    if base_tick:
+        base = baselines.get(base_tick)
+        if base is None:
+            return None
+    else:
+        base = (0,) * len(SNAP_FIELDS)
+    vals = iter(_delta_body(mask).unpack_from(payload, DELTA_HDR.size))
+    snap = tuple(next(vals) if mask >> i & 1 else base[i] for i in range(len(SNAP_FIELDS)))
+    return tick, snap
+
+
+def encode_ack(tick: int) -> bytes:
+    return frame(T_ACK, ACK_FMT.pack(tick))
+
+
+def decode_ack(payload: bytes) -> int:
+    return ACK_FMT.unpack(payload)[0]
+
+
+def encode_datagram(token: int, data: bytes) -> bytes:
+    """A client datagram: the session token, then one frame."""
+    return UDP_TOKEN.pack(token) + data
+
+
+def decode_datagram(data: bytes) -> tuple[int, int, bytes] | None:
+    """(token, frame type, payload) of a client datagram; None if malformed."""
+    hdr = UDP_TOKEN.size + FRAME_HDR.size
+    if len(data) < hdr:
+        return None
+    (token,) = UDP_TOKEN.unpack_from(data)
+    kind, size = FRAME_HDR.unpack_from(data, UDP_TOKEN.size)
+    if len(data) != hdr + size:
+        return None
+    return token, kind, data[hdr:]
+
+
+def encode_line(line: str) -> bytes:
+    return (line + "\n").encode("utf-8")
+
+
+def split_lobby(line: str) -> tuple[str, int, list[str]]:
+    """(op, version, items) of a LOBBY or LOBBY_ADD/UPD/DEL line.
+
+    Items are "name|role|status", or bare names for LOBBY_DEL. Raises
+    ValueError on a malformed line.
+    """
+    op, _, rest = line.partition(" ")
+    ver, _, items = rest.partition(" ")
+    return op, int(ver), items.split(";") if items else []
+
+
+class Framer:
+    """Splits one peer's byte stream into messages as it arrives.
+
+    feed() returns text lines as ``str`` (stripped) and binary frames as
+    ``(type, payload)`` tuples; incomplete trailing data is kept for the
+    next call. The newline search resumes where the last one stopped, so a
+    line arriving over many reads is scanned once, and a line longer than
+    ``max_line`` raises ProtocolError instead of growing the buffer.
+    """
+
+    __slots__ = ("buf", "max_line", "_scan")
+
+    def __init__(self, max_line: int = MAX_LINE):
+        self.buf = bytearray()
+        self.max_line = max_line
+        self._scan = 0  # offset in buf where the pending line's newline search resumes
+
+    def clear(self):
+        self.buf.clear()
+        self._scan = 0
+
+    def feed(self, data: bytes) -> list:
+        buf = self.buf
+        buf += data
+        out: list = []
+        pos = 0
+        n = len(buf)
+        scan = self._scan
+        while pos < n:
+            if is_frame_type(buf[pos]):
+                if n - pos < FRAME_HDR.size:
+                    break
+                kind, size = FRAME_HDR.unpack_from(buf, pos)
+                end = pos + FRAME_HDR.size + size
+                if end > n:
+                    break
+                out.append((kind, bytes(buf[pos + FRAME_HDR.size:end])))
+                pos = end
+            else:
+                i = buf.find(b"\n", scan if scan > pos else pos)
+                if i < 0:
+                    if n - pos > self.max_line:
+                        raise ProtocolError("line too long")
+                    scan = n
+                    break
+                if i - pos > self.max_line:
+                    raise ProtocolError("line too long")
+                out.append(buf[pos:i].decode("utf-8", errors="ignore").strip())
+                pos = i + 1
+        if pos:
+            del buf[:pos]
+        self._scan = scan - pos if scan > pos else 0
+        return out
+
+
+# ---- client commands ----
+
+@dataclass
+class Command:
+    """A command without arguments: REQ_PLAY, CANCEL_PLAY, ROOMS, ..."""
+    cmd: str
+
+
+@dataclass
+class Hello:
+    name: str
+    cmd: ClassVar[str] = "HELLO"
+
+
+@dataclass
+class Proto:
+    offered: list
+    cmd: ClassVar[str] = "PROTO"
+
+
+@dataclass
+class Input:
+    key: str  # "UP" or "DOWN"
+    down: int
+    seq: int = 0
+    cmd: ClassVar[str] = "INPUT"
+
+
+@dataclass
+class Chat:
+    text: str
+    cmd: ClassVar[str] = "CHAT"
+
+
+@dataclass
+class Watch:
+    rid: int
+    cmd: ClassVar[str] = "WATCH"
+
+
+@dataclass
+class Relay:
+    token: str  # must match the server's --relay-token
+    cmd: ClassVar[str] = "RELAY"
+
+
+@dataclass
+class Replay:
+    args: list  # <name> [speed] [tick | g<goal>]
+    cmd: ClassVar[str] = "REPLAY"
+
+
+BARE_COMMANDS = frozenset(("REQ_PLAY", "CANCEL_PLAY", "ROOMS", "STATS", "RECORDINGS", "LOBBY",
+                           "LEADERBOARD", "UDP", "UDP_READY"))
+
+
+def _parse_hello(arg: str):
+    name = arg.strip()
+    return Hello(name) if name else None
+
+
+def _parse_input(arg: str):
+    parts = arg.split()
+    if len(parts) < 2 or parts[0].upper() not in ("UP", "DOWN"):
+        return None
+    seq = 0
+    if len(parts) >= 3:
+        try:
+            seq = int(parts[2])
+        except ValueError:
+            pass
+        if not 0 <= seq <= SEQ_MAX:
+            return None
+    return Input(parts[0].upper(), 1 if parts[1] == "1" else 0, seq)
+
+
+def _parse_chat(arg: str):
+    text = arg.strip()
+    return Chat(text) if text else None
+
+
+def _parse_watch(arg: str):
+    try:
+        return Watch(int(arg.strip()))
+    except ValueError:
+        return None
+
+
+_PARSERS = {
+    "HELLO": _parse_hello,
+    "PROTO": lambda arg: Proto(arg.split()),
+    "INPUT": _parse_input,
+    "CHAT": _parse_chat,
+    "WATCH": _parse_watch,
+    "REPLAY": lambda arg: Replay(arg.split()) if arg.split() else None,
+    "RELAY": lambda arg: Relay(arg.strip()) if arg.strip() else None,
+}
+
+
+def parse_command(line: str):
+    """Message object for a client command line; None if unknown or malformed."""
+    cmd, sep, arg = line.partition(" ")
+    if not sep:
+        return Command(line) if line in BARE_COMMANDS else None
+    parse = _PARSERS.get(cmd)
+    return parse(arg) if parse else None
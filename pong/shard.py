@@ -0,0 +1,229 @@
+"""Run several server processes on one port (``--workers N``).
+
+The supervisor forks N workers. Each one binds the same address with
+SO_REUSEPORT, so the kernel spreads new connections across them, and each
+runs its own selector loop and matches. Players are only ever matched
+with players on the same worker.
+
+What must stay global lives in a small directory kept by the supervisor
+and reached over one socketpair per worker, using newline-terminated text
+like the client protocol:
+
+  worker -> directory   CLAIM <cid> <name>    reserve a player name
+                        RELEASE <name>
+                        LOBBY <items>         this worker's lobby entries
+  directory -> worker   CLAIMED <cid> <0|1>
+                        LOBBY <wid> <items>   another worker's entries
+
+Names are claimed asynchronously: the worker finishes HELLO when the
+CLAIMED answer arrives, so its loop never waits on the supervisor.
+"""
+from __future__ import annotations
+
+import os
+import selectors
+import signal
+import socket
+import sys
+from typing import Callable
+
+from pong import protocol
+
+CAN_SHARD = hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork")
+
+
+class _Peer:
+    """One end of a worker <-> directory socketpair, non-blocking on both sides."""
+
+    def __init__(self, sock: socket.socket, sel: selectors.BaseSelector, data):
+        sock.setblocking(False)
+        self.sock = sock
+        self.sel = sel
+        self.data = data
+        self.framer = protocol.Framer(protocol.MAX_SERVER_LINE)
+        self.out = bytearray()
+        sel.register(sock, selectors.EVENT_READ, data)
+
+    def send_line(self, line: str):
+        self.out += protocol.encode_line(line)
+        self.flush()
+
+    def flush(self):
+        try:
+            n = self.sock.send(self.out)
+            del self.out[:n]
+        except (BlockingIOError, InterruptedError):
+            pass
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.out else 0)
+        try:
+            self.sel.modify(self.sock, events, self.data)
+        except (KeyError, ValueError):
+            pass
+
+    def read_lines(self, mask: int) -> list:
+        """Handle a selector event; raises ConnectionError when the other end closed."""
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        if not mask & selectors.EVENT_READ:
+            return []
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return []
+        if not data:
+            raise ConnectionError("closed")
+        return self.framer.feed(data)
+
+    def close(self):
+        try:
+            self.sel.unregister(self.sock)
+        except (KeyError, ValueError):
+            pass
+        self.sock.close()
+
+
+class DirectoryClient:
+    """Worker side of the directory; lives on the worker's selector.
+
+    ``on_claim(cid, ok)`` and ``on_lobby(wid, items)`` are called from
+    handle() as answers and updates arrive.
+    """
+
+    def __init__(self, sock: socket.socket, wid: int):
+        self.wid = wid
+        self.sock = sock
+        self.peer: _Peer | None = None
+        self.on_claim: Callable[[int, bool], None] = lambda cid, ok: None
+        self.on_lobby: Callable[[int, str], None] = lambda wid, items: None
+
+    def attach(self, sel: selectors.BaseSelector):
+        self.peer = _Peer(self.sock, sel, self)
+
+    def claim(self, cid: int, name: str):
+        self.peer.send_line(f"CLAIM {cid} {name}")
+
+    def release(self, name: str):
+        self.peer.send_line(f"RELEASE {name}")
+
+    def publish_lobby(self, items: str):
+        self.peer.send_line(f"LOBBY {items}")
+
+    def handle(self, sock: socket.socket, mask: int):
+        try:
+            lines = self.peer.read_lines(mask)
+        except (ConnectionError, protocol.ProtocolError):
+            # supervisor gone: nothing left to coordinate with
+            raise SystemExit("[SERVER] Directory closed; worker exiting")
+        for line in lines:
+            if line.startswith("CLAIMED "):
+                _, cid, ok = line.split()
+                self.on_claim(int(cid), ok == "1")
+            elif line.startswith("LOBBY "):
+                _, wid, *rest = line.split(" ", 2)
+                self.on_lobby(int(wid), rest[0] if rest else "")
+
+
+class Directory:
+    """Supervisor side: global name ownership and every worker's lobby entries."""
+
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self.workers: dict[int, _Peer] = {}
+        self.names: dict[str, int] = {}   # name -> owning worker
+        self.lobbies: dict[int, str] = {}  # worker -> its LOBBY items
+
+    def add_worker(self, wid: int, sock: socket.socket):
+        self.workers[wid] = _Peer(sock, self.sel, wid)
+
+    def run(self):
+        while self.workers:
+            for key, mask in self.sel.select():
+                wid = key.data
+                peer = self.workers.get(wid)
+                if peer is None:
+                    continue
+                try:
+                    lines = peer.read_lines(mask)
+                except (ConnectionError, OSError, protocol.ProtocolError):
+                    self._lost(wid)
+                    continue
+                for line in lines:
+                    self._handle(wid, peer, line)
+
+    def _handle(self, wid: int, peer: _Peer, line: str):
+        if line.startswith("CLAIM "):
+            _, cid, name = line.split(" ", 2)
+            owner = self.names.get(name)
+            ok = owner is None
+            if ok:
+                self.names[name] = wid
+            peer.send_line(f"CLAIMED {cid} {int(ok)}")
+        elif line.startswith("RELEASE "):
+            name = line[8:]
+            if self.names.get(name) == wid:
+                del self.names[name]
+        elif line.startswith("LOBBY"):
+            items = line[6:]
+            self.lobbies[wid] = items
+            self._publish(wid, items)
+
+    def _publish(self, wid: int, items: str):
+        for other, p in self.workers.items():
+            if other != wid:
+                p.send_line(f"LOBBY {wid} {items}")
+
+    def _lost(self, wid: int):
+        print(f"[SERVER] Worker {wid} exited")
+        self.workers.pop(wid).close()
+        self.names = {n: w for n, w in self.names.items() if w != wid}
+        if self.lobbies.pop(wid, None):
+            self._publish(wid, "")
+
+
+def serve_sharded(workers: int, run_worker: Callable[[int, DirectoryClient], None]):
+    """Fork ``workers`` processes running ``run_worker(wid, directory)`` and supervise them."""
+    if not CAN_SHARD:
+        raise SystemExit("--workers needs SO_REUSEPORT and fork() (Linux/BSD/macOS)")
+    directory = Directory()
+    pids = []
+    for wid in range(workers):
+        parent_end, child_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            parent_end.close()
+            # close the supervisor's ends of earlier workers' pairs
+            for peer in directory.workers.values():
+                peer.sock.close()
+            directory.sel.close()
+            code = 0
+            try:
+                run_worker(wid, DirectoryClient(child_end, wid))
+            except SystemExit as e:
+                if isinstance(e.code, str):
+                    print(e.code)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            sys.stdout.flush()
+            os._exit(code)
+        child_end.close()
+        directory.add_worker(wid, parent_end)
+        pids.append(pid)
+
+    print(f"[SERVER] Supervisor {os.getpid()} running {workers} workers")
+    try:
+        directory.run()
+    except KeyboardInterrupt:
+        pass  # the workers got the same SIGINT from the terminal
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
@@ -0,0 +1,121 @@
+"""Headless, deterministic simulation of one match.
+
+MatchSim owns the paddles, ball and score and nothing else: no sockets,
+no clock. Serves are drawn from a private ``random.Random(seed)``, so the
+same seed and input stream always replay the same match.
+
+    sim = MatchSim(seed=42)
+    winner = sim.run([(0, 1)] * 600)   # left paddle holds DOWN for 10 s
+"""
+from __future__ import annotations
+
+import random
+from typing import Iterable
+
+from pong.physics import (
+    DT, WIDTH, HEIGHT, PADDLE_H, PADDLE_W, PADDLE_MARGIN, PADDLE_SPEED,
+    BALL_R, BALL_SPEED, WIN_SCORE, GOAL_OVERSHOOT, serve_velocity,
+)
+
+LX = PADDLE_MARGIN
+RX = WIDTH - PADDLE_MARGIN - PADDLE_W
+PADDLE_MAX_Y = HEIGHT - PADDLE_H
+
+
+class MatchSim:
+    __slots__ = ("seed", "rng", "tick", "ly", "ry", "bx", "by", "vx", "vy", "sl", "sr", "winner")
+
+    def __init__(self, seed: int | None = None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.tick = 0
+        self.winner: str | None = None  # "LEFT"/"RIGHT" once someone reaches WIN_SCORE
+        self.sl = 0
+        self.sr = 0
+        self.reset(full=True)
+
+    def serve(self) -> tuple[float, float]:
+        return serve_velocity(self.rng)
+
+    def reset(self, full: bool):
+        self.ly = HEIGHT/2 - PADDLE_H/2
+        self.ry = HEIGHT/2 - PADDLE_H/2
+        self.bx = WIDTH/2
+        self.by = HEIGHT/2
+        self.vx, self.vy = self.serve()
+        if full:
+            self.sl = 0
+            self.sr = 0
+            self.winner = None
+
+    def state(self) -> tuple:
+        return self.ly, self.ry, self.bx, self.by, self.sl, self.sr
+
+    def step(self, dt: float = DT, left_dir: int = 0, right_dir: int = 0) -> str | None:
+        """Advance one tick; ``*_dir`` is down - up. Returns the side that scored, if any."""
+        if self.winner:
+            return None
+        self.tick += 1
+
+        ly = self.ly + left_dir * PADDLE_SPEED * dt
+        ry = self.ry + right_dir * PADDLE_SPEED * dt
+        ly = 0 if ly < 0 else PADDLE_MAX_Y if ly > PADDLE_MAX_Y else ly
+        ry = 0 if ry < 0 else PADDLE_MAX_Y if ry > PADDLE_MAX_Y else ry
+        self.ly = ly
+        self.ry = ry
+
+        vx = self.vx
+        vy = self.vy
+        bx = self.bx + vx * dt
+        by = self.by + vy * dt
+
+        if by - BALL_R <= 0:
+            by = BALL_R
+            vy *= -1
+        elif by + BALL_R >= HEIGHT:
+            by = HEIGHT - BALL_R
+            vy *= -1
+
+        if vx < 0 and bx - BALL_R <= LX + PADDLE_W:
+            if ly <= by <= ly + PADDLE_H:
+                bx = LX + PADDLE_W + BALL_R
+                vx *= -1
+                rel = (by - (ly + PADDLE_H/2)) / (PADDLE_H/2)
+                vy = BALL_SPEED * 0.65 * rel
+
+        if vx > 0 and bx + BALL_R >= RX:
+            if ry <= by <= ry + PADDLE_H:
+                bx = RX - BALL_R
+                vx *= -1
+                rel = (by - (ry + PADDLE_H/2)) / (PADDLE_H/2)
+                vy = BALL_SPEED * 0.65 * rel
+
+        self.bx, self.by, self.vx, self.vy = bx, by, vx, vy
+
+        if bx < -GOAL_OVERSHOOT:
+            self.sr += 1
+            if self.sr >= WIN_SCORE:
+                self.winner = "RIGHT"
+            else:
+                self.reset(full=False)
+                self.vx = abs(self.vx)
+            return "RIGHT"
+
+        if bx > WIDTH + GOAL_OVERSHOOT:
+            self.sl += 1
+            if self.sl >= WIN_SCORE:
+                self.winner = "LEFT"
+            else:
+                self.reset(full=False)
+                self.vx = -abs(self.vx)
+            return "LEFT"
+        return None
+
+    def run(self, inputs: Iterable[tuple[int, int]], dt: float = DT) -> str | None:
+        """Step once per ``(left_dir, right_dir)`` until the stream or the match ends."""
+        step = self.step
+        for left_dir, right_dir in inputs:
+            step(dt, left_dir, right_dir)
+            if self.winner:
+                break
+        return self.winner
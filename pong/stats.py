@@ -0,0 +1,226 @@
+"""Player statistics in SQLite, kept off the game loop.
+
+The loop only ever calls non-blocking methods here. ``load(name)`` and
+``record(...)`` put a request on a bounded queue; a writer thread owns
+the database connection, applies the requests in order and commits at
+most every COMMIT_INTERVAL seconds (or COMMIT_EVERY results), so a burst
+of match ends costs one fsync. Every row it reads or writes comes back
+through ``poll()``, which the loop calls once per tick.
+
+The leaderboard is answered from memory. At start only the best CACHE
+rows are read; after that the cache follows the rows poll() returns, and
+is refilled from the database when rating losses push it below the
+TOP_K it must answer for, and re-read every REFRESH_INTERVAL seconds.
+Sibling ``--workers`` write the same file, and each cache only follows
+its own worker's results, so the re-read is how matches decided on other
+workers reach LEADERBOARD.
+"""
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from pong.matchmaking import DEFAULT_RATING
+
+MAX_PENDING = 4096     # queued requests; beyond this results are dropped, not waited for
+COMMIT_INTERVAL = 0.5  # seconds
+COMMIT_EVERY = 256     # results
+TOP_K = 10
+CACHE = 2 * TOP_K      # rows kept for the leaderboard
+REFRESH_INTERVAL = 5.0  # seconds between re-reads of the cached rows
+ELO_K = 32.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name    TEXT PRIMARY KEY,
+    wins    INTEGER NOT NULL DEFAULT 0,
+    losses  INTEGER NOT NULL DEFAULT 0,
+    points  INTEGER NOT NULL DEFAULT 0,
+    rating  REAL NOT NULL DEFAULT 1000
+);
+CREATE INDEX IF NOT EXISTS players_rating ON players (rating DESC);
+"""
+_UPSERT = ("INSERT INTO players (name, wins, losses, points, rating) VALUES (?, ?, ?, ?, ?) "
+           "ON CONFLICT (name) DO UPDATE SET wins = excluded.wins, losses = excluded.losses, "
+           "points = excluded.points, rating = excluded.rating")
+_TOP = "SELECT name, wins, losses, points, rating FROM players ORDER BY rating DESC LIMIT ?"
+
+_STOP = object()
+
+
+@dataclass
+class PlayerStats:
+    name: str
+    wins: int = 0
+    losses: int = 0
+    points: int = 0
+    rating: float = DEFAULT_RATING
+
+
+def elo(winner: float, loser: float) -> tuple[float, float]:
+    """New (winner, loser) ratings after one game."""
+    gain = ELO_K * (1.0 - 1.0 / (1.0 + 10.0 ** ((loser - winner) / 400.0)))
+    return winner + gain, loser - gain
+
+
+class StatsStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._requests: queue.Queue = queue.Queue(MAX_PENDING)
+        self._rows: deque = deque()  # writer -> loop: PlayerStats, or a list for a refill
+        self.dropped = 0
+        self.top: dict[str, PlayerStats] = {}
+        # every player outside ``top`` is rated at most this
+        self._floor = float("inf")
+        self._refilling = True  # the cold start is one
+        self._board: str | None = None
+        self._thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+        self._thread.start()
+
+    # ---- game loop side ----
+
+    def _put(self, req) -> bool:
+        try:
+            self._requests.put_nowait(req)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def load(self, name: str):
+        self._put(("load", name))
+
+    def record(self, winner: str, loser: str, winner_points: int, loser_points: int):
+        self._put(("result", winner, loser, winner_points, loser_points))
+
+    @property
+    def pending(self) -> int:
+        return self._requests.qsize()
+
+    def poll(self) -> list[PlayerStats]:
+        """Rows the writer read or changed since the last call; updates the leaderboard."""
+        rows = self._rows
+        out = []
+        while rows:
+            r = rows.popleft()
+            if isinstance(r, list):
+                self._refilled(r)
+            else:
+                self._update_top(r)
+                out.append(r)
+        return out
+
+    def leaderboard(self) -> str:
+        """``name|rating|wins|losses|points`` of the TOP_K best, ';'-separated."""
+        if self._board is None:
+            best = sorted(self.top.values(), key=lambda p: p.rating, reverse=True)[:TOP_K]
+            self._board = ";".join(f"{p.name}|{p.rating:.0f}|{p.wins}|{p.losses}|{p.points}"
+                                   for p in best)
+        return self._board
+
+    def close(self):
+        self._requests.put(_STOP)
+        self._thread.join(timeout=5.0)
+
+    def _update_top(self, p: PlayerStats):
+        if not (p.wins or p.losses):
+            return  # never finished a match
+        top = self.top
+        if p.name in top:
+            if p.rating < self._floor:
+                # someone outside the cache may now rank higher
+                del top[p.name]
+            else:
+                top[p.name] = p
+        elif p.rating > self._floor:
+            top[p.name] = p
+            if len(top) > CACHE:
+                low = min(top.values(), key=lambda q: q.rating)
+                del top[low.name]
+                self._floor = low.rating
+        else:
+            return
+        self._board = None
+        if len(top) < TOP_K and self._floor != float("-inf") and not self._refilling:
+            self._refilling = self._put(("top",))
+
+    def _refilled(self, rows: list[PlayerStats]):
+        self._refilling = False
+        self.top = {p.name: p for p in rows}
+        # fewer rows than asked for means every player is cached
+        self._floor = rows[-1].rating if len(rows) == CACHE else float("-inf")
+        self._board = None
+
+    # ---- writer thread ----
+
+    def _run(self):
+        db = sqlite3.connect(self.path, timeout=10.0)
+        db.execute("PRAGMA journal_mode=WAL")  # readers don't wait on another worker's writer
+        db.executescript(_SCHEMA)
+        self._rows.append(self._read_top(db))
+        uncommitted = 0
+        last_commit = time.monotonic()
+        next_refresh = last_commit + REFRESH_INTERVAL
+        while True:
+            wake = min(next_refresh, last_commit + COMMIT_INTERVAL) if uncommitted else next_refresh
+            timeout = max(0.0, wake - time.monotonic())
+            try:
+                req = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                req = None
+            if req is _STOP:
+                break
+            if req is not None:
+                try:
+                    uncommitted += self._apply(db, req)
+                except sqlite3.Error as e:
+                    print(f"[STATS] {e}")
+            if uncommitted and (uncommitted >= COMMIT_EVERY
+                                or time.monotonic() - last_commit >= COMMIT_INTERVAL):
+                try:
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"[STATS] commit failed: {e}")
+                uncommitted = 0
+                last_commit = time.monotonic()
+            if time.monotonic() >= next_refresh:
+                try:
+                    self._rows.append(self._read_top(db))
+                except sqlite3.Error as e:
+                    print(f"[STATS] {e}")
+                next_refresh = time.monotonic() + REFRESH_INTERVAL
+        db.commit()
+        db.close()
+
+    def _read_top(self, db) -> list[PlayerStats]:
+        return [PlayerStats(*row) for row in db.execute(_TOP, (CACHE,))]
+
+    def _get(self, db, name: str) -> PlayerStats:
+        row = db.execute("SELECT name, wins, losses, points, rating FROM players WHERE name = ?",
+                         (name,)).fetchone()
+        return PlayerStats(*row) if row else PlayerStats(name)
+
+    def _apply(self, db, req) -> int:
+        kind = req[0]
+        if kind == "load":
+            self._rows.append(self._get(db, req[1]))
+            return 0
+        if kind == "top":
+            self._rows.append(self._read_top(db))
+            return 0
+        _, winner, loser, wp, lp = req
+        w = self._get(db, winner)
+        l = self._get(db, loser)
+        w.rating, l.rating = elo(w.rating, l.rating)
+        w.wins += 1
+        l.losses += 1
+        w.points += wp
+        l.points += lp
+        db.executemany(_UPSERT, [(p.name, p.wins, p.losses, p.points, p.rating) for p in (w, l)])
+        self._rows.append(w)
+        self._rows.append(l)
+        return 1
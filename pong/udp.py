@@ -0,0 +1,104 @@
+"""Optional datagram channel for STATE and INPUT (``--udp-port``).
+
+On TCP one lost segment holds back every snapshot behind it. With this
+channel the hot traffic can take UDP instead, where a lost snapshot is
+just gone and the next one replaces it. TCP remains the session: lobby,
+chat and match control never leave it, and a client that cannot get
+datagrams through simply keeps using TCP.
+
+  client -> server  UDP                    over TCP, after HELLO
+  server -> client  UDP <port> <token>
+  client -> server  token + BIND frame     datagrams, repeated until answered
+  server -> client  BIND frame
+  client -> server  UDP_READY              over TCP: the path works both ways
+
+From UDP_READY on the client's snapshots are bin1 STATE frames, one per
+datagram. Client datagrams carry the token and one frame, BIND or INPUT.
+Nothing is retransmitted in the TCP sense:
+
+  STATE  sequenced by tick; the client drops anything not newer than
+         what it already has. An unchanged room repeats its last frame
+         every UDP_REPEAT ticks so a lost final snapshot heals.
+  INPUT  the client resends its latest input with every snapshot until a
+         snapshot acknowledges its seq; the server drops seqs it has
+         already applied.
+
+A bound client repeats BIND every second, which keeps NAT mappings open
+even for a spectator that sends nothing else. After UDP_TIMEOUT without a
+datagram the server sends "UDP OFF" and snapshots return to TCP; the
+client then binds again.
+"""
+from __future__ import annotations
+
+import secrets
+import selectors
+import socket
+from typing import Callable
+
+from pong import protocol
+
+MAX_DATAGRAM = 512
+BIND_FRAME = protocol.frame(protocol.T_BIND, b"")
+
+
+class UdpChannel:
+    """The server's datagram socket, served from the game loop's selector.
+
+    Datagrams are matched to their connection by token and handed to
+    ``on_packet(peer, addr, kind, payload)``; the address is the client's
+    to prove with a BIND.
+    """
+
+    MAX_BATCH = 256  # datagrams read per wakeup, so a flood cannot starve the tick
+
+    def __init__(self, sel: selectors.BaseSelector, host: str, port: int,
+                 on_packet: Callable[[object, tuple, int, bytes], None]):
+        self.sel = sel
+        self.on_packet = on_packet
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self._peers: dict[int, object] = {}  # token -> peer
+        self.rejected = 0  # malformed, or an unknown token
+        sel.register(self.sock, selectors.EVENT_READ, self)
+
+    def open(self, peer) -> int:
+        """A new session token for ``peer``."""
+        token = secrets.randbits(64)
+        while not token or token in self._peers:
+            token = secrets.randbits(64)
+        self._peers[token] = peer
+        return token
+
+    def forget(self, token: int):
+        self._peers.pop(token, None)
+
+    def send(self, addr: tuple, data: bytes) -> bool:
+        try:
+            self.sock.sendto(data, addr)
+            return True
+        except OSError:
+            return False  # socket buffer full: as good as lost on the way
+
+    def handle(self, sock: socket.socket, mask: int):
+        for _ in range(self.MAX_BATCH):
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # an ICMP error for an earlier send
+            msg = protocol.decode_datagram(data)
+            peer = self._peers.get(msg[0]) if msg else None
+            if peer is None:
+                self.rejected += 1
+                continue
+            self.on_packet(peer, addr, msg[1], msg[2])
+
+    def close(self):
+        try:
+            self.sel.unregister(self.sock)
+        except (KeyError, ValueError):
+            pass
+        self.sock.close()
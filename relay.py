@@ -0,0 +1,496 @@
+"""Spectator relay: one upstream subscription fanned out to many watchers.
+
+    python server.py --relay-token S3CRET
+    python relay.py game-host:5555 --port 5556 --token S3CRET
+    python relay.py 127.0.0.1:5556 --port 5557 --token S3CRET     # relays chain
+
+The relay connects upstream with "RELAY <token>" instead of HELLO; the
+server only accepts subscribers that present its --relay-token, and a
+relay asks the same of relays chained below it. The server then
+sends it every room's STATE, END and lifecycle tagged ``ROOM <rid> ...``,
+plus the lobby and CHAT lines every client gets. Downstream clients speak
+the normal protocol and are all spectators: WATCH, ROOMS, PROTO (text or
+bin1) and STATS are answered here, playing and chatting need the game
+server. However many people watch, the authoritative loop only feeds its
+relays.
+"""
+import argparse
+import errno
+import hmac
+import os
+import selectors
+import socket
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from pong import protocol
+from pong.conn import CHAT_HISTORY, Conn, ConnLoop, SlowConsumer
+from pong.metrics import Metrics
+
+PORT_DEFAULT = 5556
+RECONNECT_DELAY = 1.0
+CONNECT_TIMEOUT = 5.0  # seconds an upstream connect may stay in progress
+RELAY_PROTOS = (protocol.PROTO_BIN,)  # no bin2: baselines live on the game server
+
+_UPSTREAM = object()    # selector tag of the upstream socket
+_CONNECTING = object()  # ... while its connect() is still in progress
+
+
+@dataclass(eq=False)
+class RelayRoom:
+    rid: int
+    match_state: str = "WAITING"
+    left: str = ""
+    right: str = ""
+    viewers: set = field(default_factory=set)
+    state_line: bytes | None = None   # last STATE as text, for newcomers and bin1 encoding
+    state_bin: bytes | None = None
+    sl: int = 0
+    sr: int = 0
+
+    @property
+    def active(self) -> bool:
+        return self.match_state in ("PLAYING", "ENDED")
+
+
+class Relay(ConnLoop):
+    LOG = "RELAY"
+
+    def __init__(self, upstream: tuple[str, int], host: str, port: int, token: str):
+        self.upstream_addr = upstream
+        self.token = token
+        self.host = host
+        self.port = port
+
+        self.srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.srv.bind((host, port))
+        self.srv.listen(128)
+        self.srv.setblocking(False)
+
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.srv, selectors.EVENT_READ, None)
+
+        self.conns: dict[socket.socket, Conn] = {}
+        self._pending: set[Conn] = set()
+        self._relays: set[Conn] = set()  # chained relays below this one
+        self.rooms: dict[int, RelayRoom] = {}
+        # upstream lobby, kept current from its LOBBY_* deltas so newcomers
+        # and out-of-sync viewers get a snapshot from here
+        self.lobby: dict[str, str] | None = None
+        self.lobby_version = 0
+        self._lobby_full: bytes | None = None
+        self._lobby_plain: bytes | None = None  # unversioned, for clients without LOBBY_DELTAS
+        self._lobby_resync = False
+        self._chat: list[bytes] = []  # CHAT lines from the current upstream read
+        self._chat_history: deque = deque(maxlen=CHAT_HISTORY)
+
+        self.up: socket.socket | None = None
+        self._connecting: socket.socket | None = None
+        self._connect_deadline = 0.0
+        self.up_framer = protocol.Framer(protocol.MAX_SERVER_LINE)
+        self._reconnect_at = 0.0
+
+        self.metrics = Metrics()
+        self.counters = self.metrics.counters
+        m = self.metrics
+        m.gauge("connections", "Open downstream connections", lambda: len(self.conns))
+        m.gauge("relays", "Chained relays below this one", lambda: len(self._relays))
+        m.gauge("rooms_active", "Rooms playing or showing a result",
+                lambda: sum(r.active for r in self.rooms.values()))
+        m.gauge("upstream_connected", "1 while subscribed upstream", lambda: int(self.up is not None))
+
+        self.running = True
+
+    def start(self):
+        print(f"[RELAY] Listening on {self.host}:{self.port}, upstream {self.upstream_addr[0]}:{self.upstream_addr[1]}")
+        try:
+            self._loop()
+        except KeyboardInterrupt:
+            pass
+        print(f"[RELAY] Stopped. bytes encoded={self.counters['bytes_encoded']} "
+              f"sent={self.counters['bytes_sent']}")
+
+    def _loop(self):
+        # no ticks of its own: forwarding is driven by upstream reads
+        while self.running:
+            now = time.monotonic()
+            if self._connecting is not None and now >= self._connect_deadline:
+                self._connect_failed("timed out")
+            if self.up is None and self._connecting is None and now >= self._reconnect_at:
+                self._connect_upstream()
+            timeout = None if self.up is not None else RECONNECT_DELAY
+            for key, mask in self.sel.select(timeout):
+                if key.data is None:
+                    self._accept()
+                elif key.data is _UPSTREAM:
+                    self._on_upstream()
+                elif key.data is _CONNECTING:
+                    self._on_connected()
+                else:
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(key.data)
+                    if mask & selectors.EVENT_READ:
+                        self._on_readable(key.data)
+            t0 = time.perf_counter()
+            self._flush_all()
+            self.metrics.flush.observe(time.perf_counter() - t0)
+
+    # ---- upstream ----
+
+    def _connect_upstream(self):
+        # non-blocking: downstream viewers keep being served while this is in flight
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        try:
+            err = s.connect_ex(self.upstream_addr)
+        except OSError as e:  # the host name did not resolve
+            s.close()
+            self._retry_upstream(str(e))
+            return
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            s.close()
+            self._retry_upstream(os.strerror(err))
+            return
+        self._connecting = s
+        self._connect_deadline = time.monotonic() + CONNECT_TIMEOUT
+        self.sel.register(s, selectors.EVENT_WRITE, _CONNECTING)
+
+    def _on_connected(self):
+        s = self._connecting
+        err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if not err:
+            try:
+                # a fresh socket's send buffer is empty, so this short line goes out whole
+                s.send(protocol.encode_line(f"RELAY {self.token}"))
+            except OSError as e:
+                err = e.errno
+        if err:
+            self._connect_failed(os.strerror(err))
+            return
+        self._connecting = None
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.up = s
+        self.up_framer.clear()
+        self.lobby = None
+        self._lobby_resync = False
+        self.sel.modify(s, selectors.EVENT_READ, _UPSTREAM)
+        print("[RELAY] Subscribed upstream")
+
+    def _connect_failed(self, why: str):
+        s, self._connecting = self._connecting, None
+        try:
+            self.sel.unregister(s)
+        except (KeyError, ValueError):
+            pass
+        s.close()
+        self._retry_upstream(why)
+
+    def _retry_upstream(self, why: str):
+        print(f"[RELAY] Upstream unavailable ({why}); retrying")
+        self._reconnect_at = time.monotonic() + RECONNECT_DELAY
+
+    def _lost_upstream(self):
+        print("[RELAY] Upstream lost")
+        try:
+            self.sel.unregister(self.up)
+        except (KeyError, ValueError):
+            pass
+        self.up.close()
+        self.up = None
+        self._reconnect_at = time.monotonic() + RECONNECT_DELAY
+        # the upstream resends every active room on reconnect
+        for rid in list(self.rooms):
+            self._set_room(rid, "WAITING", "", "")
+
+    def _on_upstream(self):
+        try:
+            data = self.up.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._lost_upstream()
+            return
+        self.counters["bytes_received"] += len(data)
+        t0 = time.perf_counter()
+        try:
+            msgs = self.up_framer.feed(data)
+        except protocol.ProtocolError:
+            self._lost_upstream()
+            return
+        for line in msgs:
+            if isinstance(line, str):
+                self._on_upstream_line(line)
+        if self._chat:
+            # the server sends a tick's chat as one write; pass it on as one
+            self._chat_history.extend(self._chat)
+            self._fanout(b"".join(self._chat), self.conns.values(), kind="CHAT")
+            self._chat.clear()
+        self.metrics.broadcast.observe(time.perf_counter() - t0)
+
+    def _on_upstream_line(self, line: str):
+        if line.startswith("ROOM "):
+            _, rid, rest = line.split(" ", 2)
+            rid = int(rid)
+            # chained relays get the tagged line untouched
+            if self._relays:
+                self._fanout(self._encode(line), self._relays, droppable=rest.startswith("STATE "),
+                             kind="ROOM", stream=rid)
+            if rest.startswith("STATE "):
+                self._on_state(rid, rest)
+            elif rest.startswith("MATCH "):
+                _, state, names = rest.split(" ", 2)
+                left, _, right = names.partition("|")
+                self._set_room(rid, state, left, right)
+            elif rest.startswith("END "):
+                room = self.rooms.get(rid)
+                if room is not None:
+                    self._fanout(self._encode(rest), room.viewers, kind="END")
+        elif line.startswith("LOBBY"):
+            self._on_lobby(line)
+        elif line.startswith("CHAT "):
+            self._chat.append(self._encode(line))
+        elif line.startswith("ERROR "):
+            print(f"[RELAY] Upstream refused: {line[6:]}")
+
+    def _on_lobby(self, line: str):
+        try:
+            op, ver, items = protocol.split_lobby(line)
+        except ValueError:
+            return
+        if op == "LOBBY":
+            self.lobby = dict(i.split("|", 1) for i in items if "|" in i)
+            self.lobby_version = ver
+            self._lobby_full = self._lobby_plain = None
+            self._lobby_resync = False
+            # downstream copies may have missed deltas while this one was out of sync
+            self._fanout_lobby(None)
+            return
+        if self.lobby is None or ver != self.lobby_version + 1:
+            if not self._lobby_resync:
+                self._lobby_resync = True
+                try:
+                    self.up.send(b"LOBBY\n")
+                except OSError:
+                    pass
+            return
+        for i in items:
+            if op == "LOBBY_DEL":
+                self.lobby.pop(i, None)
+            elif "|" in i:
+                name, e = i.split("|", 1)
+                self.lobby[name] = e
+        self.lobby_version = ver
+        self._lobby_full = self._lobby_plain = None
+        self._fanout_lobby(line)
+
+    def _fanout_lobby(self, delta: str | None):
+        # versioned viewers get the delta (or a new snapshot), the rest a whole LOBBY line
+        versioned, plain = [], []
+        for c in self.conns.values():
+            if c.lobby:
+                versioned.append(c)
+            elif c.name:
+                plain.append(c)
+        if versioned:
+            if delta is None:
+                self._fanout(self._lobby_snapshot(True), versioned, kind="LOBBY")
+            else:
+                self._fanout(self._encode(delta), versioned, kind=delta.split(" ", 1)[0])
+        if plain:
+            self._fanout(self._lobby_snapshot(False), plain, kind="LOBBY")
+
+    def _lobby_snapshot(self, versioned: bool) -> bytes | None:
+        if self.lobby is None:
+            return None
+        if versioned:
+            if self._lobby_full is None:
+                items = ";".join(f"{n}|{e}" for n, e in self.lobby.items())
+                self._lobby_full = self._encode(f"LOBBY {self.lobby_version} {items}")
+            return self._lobby_full
+        if self._lobby_plain is None:
+            self._lobby_plain = self._encode(f"LOBBY {';'.join(f'{n}|{e}' for n, e in self.lobby.items())}")
+        return self._lobby_plain
+
+    def _send_lobby(self, c: Conn):
+        data = self._lobby_snapshot(c.lobby)
+        if data is not None:
+            self._send_bytes(c, data)
+
+    def _on_state(self, rid: int, rest: str):
+        room = self.rooms.get(rid)
+        if room is None:
+            return
+        room.state_line = self._encode(rest)
+        room.state_bin = None
+        try:
+            f = _state_fields(rest)
+            room.sl, room.sr = int(f["sl"]), int(f["sr"])
+        except (KeyError, ValueError):
+            pass
+        text, binary = [], []
+        for c in room.viewers:
+            (binary if c.proto == protocol.PROTO_BIN else text).append(c)
+        if text:
+            self._fanout(room.state_line, text, droppable=True, kind="STATE")
+        if binary:
+            self._fanout(self._state_bin(room, rest), binary, droppable=True, kind="STATE")
+
+    def _state_bin(self, room: RelayRoom, rest: str) -> bytes:
+        if room.state_bin is None:
+            f = _state_fields(rest)
+            room.state_bin = protocol.encode_state(
+                int(f["t"]), float(f["ly"]), float(f["ry"]), float(f["bx"]), float(f["by"]),
+                int(f["sl"]), int(f["sr"]), int(f.get("al", 0)), int(f.get("ar", 0)))
+            self.counters["bytes_encoded"] += len(room.state_bin)
+        return room.state_bin
+
+    def _set_room(self, rid: int, state: str, left: str, right: str):
+        room = self.rooms.get(rid)
+        if room is None:
+            if state == "WAITING":
+                return
+            room = self.rooms[rid] = RelayRoom(rid)
+        was_active = room.active
+        room.match_state, room.left, room.right = state, left, right
+        if state == "WAITING":
+            del self.rooms[rid]
+            viewers = list(room.viewers)
+            for v in viewers:
+                self._watch(v, None)
+            for v in viewers:
+                self._auto_watch(v)
+                self._send(v, f"MATCH {self._match_state_of(v)}")
+        elif not was_active:
+            # a match started: idle spectators follow it
+            for c in self.conns.values():
+                if c.room is None and not c.relay:
+                    self._auto_watch(c)
+                    self._send(c, f"MATCH {self._match_state_of(c)}")
+        else:
+            for v in room.viewers:
+                self._send(v, f"MATCH {state}")
+
+    # ---- downstream ----
+
+    def _greet(self, c: Conn):
+        self._send(c, "ROLE SPECTATOR")
+        self._send(c, f"MATCH {self._match_state_of(c)}")
+        self._send_lobby(c)
+
+    def _watched(self, c: Conn, old: RelayRoom | None, room: RelayRoom | None):
+        if room is not None and room.state_line is not None:
+            # no snapshot history here: hand over the latest one now
+            if c.proto == protocol.PROTO_BIN:
+                self._send_bytes(c, self._state_bin(room, room.state_line.decode().strip()), True)
+            else:
+                self._send_bytes(c, room.state_line, True)
+
+    def _on_readable(self, c: Conn):
+        if c.sock not in self.conns:
+            return
+        try:
+            data = c.sock.recv(4096)
+            if not data:
+                raise ConnectionError("closed")
+            self.counters["bytes_received"] += len(data)
+            for msg in c.framer.feed(data):
+                if isinstance(msg, str):
+                    cmd = protocol.parse_command(msg) if msg else None
+                    self.metrics.count_in(cmd.cmd if cmd else "OTHER", len(msg) + 1)
+                    if cmd:
+                        self._handle_command(c, cmd)
+        except BlockingIOError:
+            pass
+        except Exception:
+            self._drop_conn(c.sock)
+
+    def _handle_command(self, c: Conn, cmd):
+        kind = type(cmd)
+        if kind is protocol.Hello:
+            # relay viewers never reach the game server, so names need not be unique
+            c.name = cmd.name
+            self._send(c, "ROLE SPECTATOR")
+            self._send(c, f"MATCH {self._match_state_of(c)}")
+            if self._chat_history:
+                self._send_bytes(c, b"".join(self._chat_history))
+            self._send(c, "CHAT Server: Watching through a relay; connect to the game server to play or chat.")
+            self._send_lobby(c)
+        elif kind is protocol.Proto:
+            c.proto = next((p for p in RELAY_PROTOS if p in cmd.offered), "text")
+            if protocol.LOBBY_DELTAS in cmd.offered:
+                self._send(c, f"PROTO {c.proto} {protocol.LOBBY_DELTAS}")
+                if not c.lobby:
+                    c.lobby = True
+                    self._send_lobby(c)
+            else:
+                self._send(c, f"PROTO {c.proto}")
+        elif kind is protocol.Watch:
+            room = self.rooms.get(cmd.rid)
+            if room is None or not room.active:
+                return
+            self._watch(c, room)
+            self._send(c, f"MATCH {room.match_state}")
+        elif kind is protocol.Chat or cmd.cmd in ("REQ_PLAY", "CANCEL_PLAY"):
+            self._send(c, "CHAT Server: This is a spectator relay.")
+        elif cmd.cmd == "ROOMS":
+            items = [f"{r.rid}|{r.left}|{r.right}|{r.sl}|{r.sr}"
+                     for r in self.rooms.values() if r.active and r.left and r.right]
+            self._send(c, f"ROOMS {';'.join(items)}")
+        elif kind is protocol.Relay:
+            if not hmac.compare_digest(cmd.token.encode(), self.token.encode()):
+                self._send(c, "ERROR RelayDenied")
+                return
+            c.relay = True
+            c.lobby = True
+            self._relays.add(c)
+            self._watch(c, None)
+            for r in self.rooms.values():
+                self._send(c, f"ROOM {r.rid} MATCH {r.match_state} {r.left}|{r.right}")
+            self._send_lobby(c)
+        elif cmd.cmd == "STATS":
+            self._send(c, f"STATS {self.metrics.summary()}")
+        elif cmd.cmd == "LOBBY":
+            c.lobby = True  # only versioned clients ask
+            self._send_lobby(c)
+
+    # ---- output ----
+
+    def _send(self, c: Conn, line: str):
+        try:
+            c.send_line(line)
+        except SlowConsumer:
+            pass
+
+    def _send_bytes(self, c: Conn, data: bytes, droppable: bool = False):
+        try:
+            c.send_bytes(data, droppable)
+        except SlowConsumer:
+            pass
+
+
+def _state_fields(rest: str) -> dict[str, str]:
+    """key=value fields of a ``STATE t=.. ly=..`` line."""
+    return dict(p.split("=", 1) for p in rest.split()[1:] if "=" in p)
+
+
+def _addr(s: str) -> tuple[str, int]:
+    host, _, port = s.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Classic Pong spectator relay")
+    ap.add_argument("upstream", type=_addr, help="game server or relay to subscribe to, HOST:PORT")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=PORT_DEFAULT)
+    ap.add_argument("--token", required=True,
+                    help="the game server's --relay-token; relays chained below this one must present it too")
+    args = ap.parse_args()
+    Relay(args.upstream, args.host, args.port, args.token).start()
+
+if __name__ == "__main__":
+    main()
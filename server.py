@@ -1,438 +1,1222 @@
+import hmac
+import os
+import random
+import selectors
+import signal
 import socket
-import threading
 import time
+from collections import deque
 from dataclasses import dataclass, field
 
+from pong import protocol
+from pong.conn import CHAT_BURST, CHAT_HISTORY, CHAT_RATE, Conn, ConnLoop, SlowConsumer
+from pong.matchmaking import MatchQueue, RatingMatcher
+from pong.metrics import Metrics, MetricsHTTP
+from pong.recording import Playback, Recorder, input_bits, list_recordings
+from pong.shard import DirectoryClient, serve_sharded
+from pong.stats import StatsStore
+from pong.udp import BIND_FRAME, UdpChannel
+from pong.physics import TICK_HZ, DT
+from pong.sim import MatchSim
+
 HOST_DEFAULT = "0.0.0.0"
 PORT_DEFAULT = 5555
 
-TICK_HZ = 60
-DT = 1.0 / TICK_HZ
-
-# game field (logical units)
-WIDTH = 800
-HEIGHT = 500
-
-PADDLE_H = 90
-PADDLE_W = 12
-PADDLE_MARGIN = 24
-PADDLE_SPEED = 360.0  # units/s
-
-BALL_R = 8
-BALL_SPEED = 360.0
-
-WIN_SCORE = 7
-
-@dataclass
-class Conn:
-    sock: socket.socket
-    addr: tuple
-    name: str = ""
-    role: str = "SPECTATOR"   # LEFT/RIGHT/SPECTATOR
-    status: str = "WAITING"   # WAITING/QUEUED/PLAYING
-    up: int = 0
-    down: int = 0
-    buf: bytearray = field(default_factory=bytearray)
-
-    def send_line(self, line: str):
-        self.sock.sendall((line + "\n").encode("utf-8"))
-
-class PongServer:
-    def __init__(self, host: str, port: int):
+SNAPSHOT_HZ = 30  # STATE broadcasts per second, driven by the tick counter
+
+MAX_ROOMS = 256
+MAX_CATCHUP_STEPS = 5
+SNAPSHOT_HISTORY = 32  # baselines kept per room for delta snapshots
+
+# inbound flood control, per connection
+CMD_BUDGET = 32             # messages handled per tick; the rest of that read is dropped
+FLOOD_TICKS = 2 * TICK_HZ   # consecutive over-budget ticks before the client is cut off
+
+UDP_REPEAT = TICK_HZ // 4   # ticks between repeats of an unchanged snapshot over UDP
+UDP_TIMEOUT = 5.0           # seconds without a datagram before a client goes back to TCP
+
+def _latest_key(msg):
+    """What a message overrides if only the newest of its kind matters, else None."""
+    if isinstance(msg, str):
+        if msg.startswith("INPUT "):
+            return msg[6:].split(" ", 1)[0].upper()  # text INPUT is per key
+        return None
+    return msg[0] if msg[0] in (protocol.T_INPUT, protocol.T_ACK) else None
+
+@dataclass(eq=False)
+class Room:
+    rid: int
+    slot: int = 0  # index in BatchPhysics arrays
+    left: Conn | None = None
+    right: Conn | None = None
+    viewers: set = field(default_factory=set)  # players + spectators watching
+
+    sim: MatchSim = field(default_factory=MatchSim)  # paddles, ball and score
+    match_state: str = "WAITING"  # WAITING/PLAYING/ENDED
+    _ended_at: float = 0.0
+    _last_snap: tuple | None = None  # last quantized snapshot sent, to skip repeats
+    snapshots: dict = field(default_factory=dict)  # tick -> quantized snapshot (delta baselines)
+    recorder: Recorder | None = None  # --record-dir: this match's recording
+    udp_state: bytes | None = None    # last STATE frame sent over UDP, repeated while unchanged
+    udp_at: int = 0                   # tick it was last sent
+    replay: Playback | None = None    # REPLAY rooms play a recording instead of a MatchSim
+    replay_pos: float = 0.0
+    replay_speed: float = 1.0
+    replay_owner: Conn | None = None  # who asked for it; one replay per connection
+
+    @property
+    def active(self) -> bool:
+        return self.match_state in ("PLAYING", "ENDED")
+
+class PongServer(ConnLoop):
+    def __init__(self, host: str, port: int, max_rooms: int = MAX_ROOMS,
+                 snapshot_hz: int = SNAPSHOT_HZ, batch_physics: bool = False,
+                 seed: int | None = None, metrics_port: int | None = None,
+                 reuse_port: bool = False, directory: DirectoryClient | None = None,
+                 record_dir: str | None = None, matchmaker: str = "fifo",
+                 stats_db: str | None = None, udp_port: int | None = None,
+                 relay_token: str | None = None):
         self.host = host
         self.port = port
 
         self.srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # sibling workers bind the same port; the kernel balances accepts
+            self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.srv.bind((host, port))
-        self.srv.listen(32)
+        self.srv.listen(128)
+        self.srv.setblocking(False)
+
+        # single-threaded event loop: listener and clients share one selector
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.srv, selectors.EVENT_READ, None)
 
-        self.lock = threading.Lock()
         self.conns: dict[socket.socket, Conn] = {}
         self.name_map: dict[str, Conn] = {}
-
-        self.queue: list[Conn] = []
-        self.left: Conn | None = None
-        self.right: Conn | None = None
-
-        self.ly = HEIGHT/2 - PADDLE_H/2
-        self.ry = HEIGHT/2 - PADDLE_H/2
-        self.bx = WIDTH/2
-        self.by = HEIGHT/2
-        self.vx = BALL_SPEED
-        self.vy = BALL_SPEED * 0.3
-
-        self.sl = 0
-        self.sr = 0
-        self.match_state = "WAITING"  # WAITING/PLAYING/ENDED
-        self._ended_at = 0.0
+        self._pending: set[Conn] = set()  # conns with queued output
+        self._relays: set[Conn] = set()
+        self.relay_token = relay_token  # RELAY is refused unless this is set and matches
+        self.metrics = Metrics()
+        self.counters = self.metrics.counters
+
+        if matchmaker == "rating":
+            self.queue = RatingMatcher(rating=lambda c: c.rating)
+        else:
+            self.queue = MatchQueue()
+        self._queue_dirty = False  # queue or free rooms changed since the last pairing
+        self._chat: list[bytes] = []  # CHAT lines waiting for this tick's fan-out
+        self._chat_history: deque = deque(maxlen=CHAT_HISTORY)
+        self._inputs: list[Conn] = []  # conns with a next_input
+        self._paused: list[Conn] = []
+        self.max_rooms = max_rooms
+        self.rooms: dict[int, Room] = {}
+        self._next_rid = 1
+
+        # every match gets its own MatchSim seed drawn from here
+        self.rng = random.Random(seed)
+
+        # optional NumPy stepper; PLAYING rooms then live in its arrays
+        self.batch = None
+        self._slots: list[Room] = []
+        self._ending: set[Room] = set()  # ENDED rooms waiting to close
+        if batch_physics:
+            from pong.batch import BatchPhysics
+            self.batch = BatchPhysics(max_rooms, serve=lambda slot: self._slots[slot].sim.serve())
+
+        # match recordings, and REPLAY rooms streaming them back
+        self.record_dir = record_dir
+        self._recording: set[Room] = set()
+        self._replays: set[Room] = set()
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+
+        # --stats-db: wins/losses/rating per name; all disk work on its own thread
+        self.stats = StatsStore(stats_db) if stats_db else None
+
+        self.tick = 0
+        self.snapshot_every = max(1, round(TICK_HZ / max(1, snapshot_hz)))
+        self._last_snapshot_tick = -self.snapshot_every
+
+        m = self.metrics
+        m.gauge("tick", "Simulation ticks since start", lambda: self.tick)
+        m.gauge("connections", "Open client connections", lambda: len(self.conns))
+        m.gauge("relays", "Downstream relay.py subscribers", lambda: len(self._relays))
+        m.gauge("queue_length", "Players waiting for a match", lambda: len(self.queue))
+        m.gauge("rooms_active", "Rooms playing or showing a result", lambda: len(self._active_rooms()))
+        m.gauge("outbound_bytes", "Bytes queued but not yet written",
+                lambda: sum(c.out_bytes for c in self._pending))
+        if self.stats is not None:
+            m.gauge("stats_pending", "Stats requests waiting for the writer thread",
+                    lambda: self.stats.pending)
+            m.gauge("stats_dropped", "Stats requests dropped because the queue was full",
+                    lambda: self.stats.dropped)
+        # optional Prometheus scrape endpoint, served from the same loop
+        self.metrics_http = None
+        if metrics_port is not None:
+            self.metrics_http = MetricsHTTP(self.sel, "127.0.0.1", metrics_port, m.render)
+
+        # --udp-port: STATE and INPUT over datagrams for clients that ask
+        self.udp = None
+        if udp_port is not None:
+            self.udp = UdpChannel(self.sel, host, udp_port, self._on_datagram)
+            m.gauge("udp_rejected", "Datagrams with a bad header or unknown token",
+                    lambda: self.udp.rejected)
+
+        # --workers: names and lobby are shared through the supervisor
+        self.directory = directory
+        self._claims: dict[int, tuple[Conn, str]] = {}  # claim id -> HELLO waiting on it
+        self._next_claim = 1
+        self._remote_lobby: dict[int, str] = {}  # worker id -> its LOBBY items
+        self._lobby_published = ""
+
+        # The lobby as clients last saw it: name -> "role|status". Changes are
+        # diffed against it once per tick and sent as versioned deltas.
+        self._lobby: dict[str, str] = {}
+        self.lobby_version = 0
+        self._lobby_dirty = False
+        self._lobby_full: bytes | None = None   # cached LOBBY snapshot for newcomers
+        self._lobby_plain: bytes | None = None  # the same without a version, for older clients
+        if directory is not None:
+            directory.attach(self.sel)
+            directory.on_claim = self._on_claim
+            directory.on_lobby = self._on_remote_lobby
 
         self.running = True
 
     def start(self):
         print(f"[SERVER] Listening on {self.host}:{self.port}")
-        threading.Thread(target=self._accept_loop, daemon=True).start()
-        self._game_loop()
-
-    def _accept_loop(self):
-        while self.running:
-            try:
-                cs, addr = self.srv.accept()
-                cs.setblocking(False)
-            except Exception:
-                continue
-
-            c = Conn(sock=cs, addr=addr)
-            with self.lock:
-                self.conns[cs] = c
-
-            print(f"[SERVER] New connection: {addr}")
+        if self.metrics_http is not None:
+            print(f"[SERVER] Metrics on http://127.0.0.1:{self.metrics_http.port}/metrics")
+        if self.udp is not None:
+            print(f"[SERVER] STATE/INPUT datagrams on {self.host}:{self.udp.port}/udp")
+        # SIGTERM (a service manager's stop) ends the loop like Ctrl-C does
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "running", False))
+        try:
+            self._game_loop()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for room in list(self._recording):
+                self._stop_recording(room)  # flush what was played so far
+            if self.stats is not None:
+                self.stats.close()
+        print(f"[SERVER] Stopped. bytes encoded={self.counters['bytes_encoded']} "
+              f"sent={self.counters['bytes_sent']}")
+
+    def _greet(self, c: Conn):
+        print(f"[SERVER] New connection: {c.addr}")
+        try:
+            c.send_line("ROLE SPECTATOR")
+            c.send_line(f"MATCH {self._match_state_of(c)}")
+        except Exception:
+            self._drop_conn(c.sock)
+
+    # ---- rooms ----
+
+    def _free_room(self) -> Room | None:
+        for room in self.rooms.values():
+            if room.match_state == "WAITING":
+                return room
+        if len(self.rooms) >= self.max_rooms:
+            return None
+        room = Room(rid=self._next_rid, slot=len(self._slots))
+        self._next_rid += 1
+        self.rooms[room.rid] = room
+        self._slots.append(room)
+        return room
+
+    def _active_rooms(self) -> list[Room]:
+        return [r for r in self.rooms.values() if r.active]
+
+    def _watched(self, c: Conn, old: Room | None, room: Room | None):
+        c.acked = 0
+        c.watch_tick = self.tick
+        if room is not None:
+            room._last_snap = None  # newcomer needs a snapshot
+        if old is not None and old.replay is not None and not old.viewers:
+            self._close_room(old)  # a replay nobody watches only holds a room
+
+    def _close_room(self, room: Room):
+        # return both players to the lobby and move the room's audience along
+        viewers = list(room.viewers)
+        room.left = None
+        room.right = None
+        room.match_state = "WAITING"
+        self._queue_dirty = True  # a room is free again
+        self._ending.discard(room)
+        if self.batch is not None:
+            self.batch.release(room.slot)
+        room.sim.reset(full=True)
+        if room.recorder is not None:
+            self._stop_recording(room)  # aborted match: keep what was played
+        if room.replay is not None:
+            self._replays.discard(room)
+            room.replay.close()
+            room.replay = None
+            room.replay_owner = None
+        self._relay_room(room)
+        for v in viewers:
+            self._watch(v, None)
+        for v in viewers:
+            self._auto_watch(v)
             try:
-                c.send_line("ROLE SPECTATOR")
-                c.send_line(f"MATCH {self.match_state}")
+                v.send_line(f"MATCH {self._match_state_of(v)}")
             except Exception:
-                self._drop_conn(cs)
+                pass
 
-    def _drop_conn(self, cs: socket.socket):
-        with self.lock:
-            c = self.conns.pop(cs, None)
-            if not c:
-                return
-            if c.name and self.name_map.get(c.name) is c:
-                self.name_map.pop(c.name, None)
-            if c in self.queue:
+    def _dropped(self, c: Conn):
+        if c.udp_token:
+            self.udp.forget(c.udp_token)
+        if c.name and self.name_map.get(c.name) is c:
+            self.name_map.pop(c.name, None)
+            if self.directory is not None:
+                self.directory.release(c.name)
+        if self.queue.discard(c):
+            self._queue_dirty = True
+
+        room = c.room
+        self._watch(c, None)
+        if room and c in (room.left, room.right):
+            other = room.right if room.left is c else room.left
+            if other:
+                other.role = "SPECTATOR"
+                other.status = "WAITING"
                 try:
-                    self.queue.remove(c)
-                except ValueError:
+                    other.send_line("ROLE SPECTATOR")
+                    other.send_line("CHAT Server: Opponent disconnected. Back to lobby.")
+                except Exception:
                     pass
+            self._close_room(room)
 
-            was_left = (self.left is c)
-            was_right = (self.right is c)
-            if was_left or was_right:
-                other = self.right if was_left else self.left
-                self.left = None
-                self.right = None
-                if other:
-                    other.role = "SPECTATOR"
-                    other.status = "WAITING"
-                    try:
-                        other.send_line("ROLE SPECTATOR")
-                        other.send_line("MATCH WAITING")
-                        other.send_line("CHAT Server: Opponent disconnected. Back to lobby.")
-                    except Exception:
-                        pass
-                self._reset_game(full=True)
-                self.match_state = "WAITING"
-
-        try:
-            cs.close()
-        except Exception:
-            pass
-
-        self._broadcast_lobby()
+        self._lobby_changed()
 
-    def _recv_lines(self, c: Conn) -> list[str]:
-        lines = []
+    def _recv_lines(self, c: Conn) -> list:
+        t0 = time.perf_counter()
         try:
             data = c.sock.recv(4096)
-            if not data:
-                raise ConnectionError("closed")
-            c.buf.extend(data)
-            while b"\n" in c.buf:
-                i = c.buf.index(b"\n")
-                raw = c.buf[:i]
-                del c.buf[:i+1]
-                lines.append(raw.decode("utf-8", errors="ignore").strip())
         except BlockingIOError:
+            return []
+        if not data:
+            raise ConnectionError("closed")
+        self.counters["bytes_received"] += len(data)
+        msgs = c.framer.feed(data)
+        self.metrics.recv.observe(time.perf_counter() - t0)
+        return msgs
+
+    def _broadcast(self, line: str, targets=None):
+        self._fanout(self._encode(line), self.conns.values() if targets is None else targets,
+                     kind=line.split(" ", 1)[0])
+
+    def _lobby_changed(self):
+        self._lobby_dirty = True
+
+    def _send_lobby(self, c: Conn):
+        data = self._lobby_line(c.lobby)
+        c.send_bytes(data)
+        self.metrics.count_out("LOBBY", len(data))
+
+    def _lobby_line(self, versioned: bool) -> bytes:
+        # clients that never offered LOBBY_DELTAS only understand "LOBBY <items>"
+        if versioned:
+            if self._lobby_full is None:
+                items = ";".join(f"{n}|{e}" for n, e in self._lobby.items())
+                self._lobby_full = self._encode(f"LOBBY {self.lobby_version} {items}")
+            return self._lobby_full
+        if self._lobby_plain is None:
+            self._lobby_plain = self._encode(f"LOBBY {';'.join(f'{n}|{e}' for n, e in self._lobby.items())}")
+        return self._lobby_plain
+
+    def _flush_lobby(self):
+        # however many joins, leaves and status changes came in this tick,
+        # viewers get at most one LOBBY_ADD, LOBBY_UPD and LOBBY_DEL
+        if not self._lobby_dirty:
+            return
+        self._lobby_dirty = False
+        local = {c.name: f"{c.role}|{c.status}" for c in self.name_map.values()}
+        entries = local
+        if self.directory is not None:
+            items = ";".join(f"{n}|{e}" for n, e in local.items())
+            if items != self._lobby_published:
+                self._lobby_published = items
+                self.directory.publish_lobby(items)
+            entries = dict(local)
+            for items in self._remote_lobby.values():
+                for chunk in items.split(";") if items else ():
+                    name, _, e = chunk.partition("|")
+                    entries.setdefault(name, e)
+
+        old = self._lobby
+        added = [f"{n}|{e}" for n, e in entries.items() if n not in old]
+        updated = [f"{n}|{e}" for n, e in entries.items() if n in old and old[n] != e]
+        removed = [n for n in old if n not in entries]
+        if not (added or updated or removed):
+            return
+        self._lobby = entries
+        self._lobby_full = self._lobby_plain = None
+        targets = [c for c in self.conns.values() if c.lobby]
+        # each line bumps the version; a client that sees a gap asks for LOBBY
+        for op, items in (("LOBBY_ADD", added), ("LOBBY_UPD", updated), ("LOBBY_DEL", removed)):
+            if items:
+                self.lobby_version += 1
+                self._broadcast(f"{op} {self.lobby_version} {';'.join(items)}", targets)
+        plain = [c for c in self.conns.values() if c.name and not c.lobby]
+        if plain:
+            self._fanout(self._lobby_line(False), plain, kind="LOBBY")
+
+    def _flush_chat(self):
+        if not self._chat:
+            return
+        data = b"".join(self._chat)
+        self._chat_history.extend(self._chat)
+        self._chat.clear()
+        self._fanout(data, self.conns.values(), kind="CHAT")
+
+    def _relay_room(self, room: Room):
+        # relays track room lifecycles themselves to serve WATCH/ROOMS locally
+        if self._relays:
+            left = room.left.name if room.left else ""
+            right = room.right.name if room.right else ""
+            self._broadcast(f"ROOM {room.rid} MATCH {room.match_state} {left}|{right}", self._relays)
+
+    def _add_relay(self, c: Conn):
+        c.relay = True
+        c.lobby = True
+        self._relays.add(c)
+        self._watch(c, None)
+        try:
+            for room in self._active_rooms():
+                left = room.left.name if room.left else ""
+                right = room.right.name if room.right else ""
+                c.send_line(f"ROOM {room.rid} MATCH {room.match_state} {left}|{right}")
+            self._send_lobby(c)
+        except Exception:
             pass
-        return lines
 
-    def _broadcast(self, line: str):
-        dead = []
-        with self.lock:
-            for cs, c in self.conns.items():
-                try:
-                    c.send_line(line)
-                except Exception:
-                    dead.append(cs)
-        for cs in dead:
-            self._drop_conn(cs)
+    def _on_remote_lobby(self, wid: int, items: str):
+        self._remote_lobby[wid] = items
+        self._lobby_changed()
 
-    def _broadcast_lobby(self):
-        with self.lock:
-            items = []
-            for c in self.conns.values():
-                if not c.name:
-                    continue
-                items.append(f"{c.name}|{c.role}|{c.status}")
-        self._broadcast(f"LOBBY {';'.join(items)}")
+    def _on_claim(self, cid: int, ok: bool):
+        c, name = self._claims.pop(cid, (None, None))
+        if c is None:
+            return
+        if c.sock not in self.conns:
+            if ok:
+                self.directory.release(name)  # left while the claim was in flight
+            return
+        held, c.held = c.held or [], None
+        self._set_events(c)
+        if ok:
+            self._hello(c, name)
+        else:
+            try:
+                c.send_line("ERROR NameTaken")
+            except Exception:
+                pass
+        try:
+            self._dispatch(c, held)
+        except Exception:
+            self._drop_conn(c.sock)
 
     def _maybe_start_match(self):
-        with self.lock:
-            if self.match_state == "PLAYING":
-                return
-            self.queue = [c for c in self.queue if c.sock in self.conns and c.name]
-            if len(self.queue) < 2:
-                return
-
-            self.left = self.queue.pop(0)
-            self.right = self.queue.pop(0)
-
-            self.left.role = "LEFT"
-            self.right.role = "RIGHT"
-            self.left.status = "PLAYING"
-            self.right.status = "PLAYING"
-
-            self.match_state = "PLAYING"
-            self._reset_game(full=True)
+        now = time.monotonic()
+        if not self._queue_dirty and now < self.queue.retry_at:
+            return
+        self._queue_dirty = False
+        started = False
+        while len(self.queue) >= 2:
+            room = self._free_room()
+            if room is None:
+                break
+            pair = self.queue.pop_pair(now)
+            if pair is None:
+                break
+
+            left, right = pair
+            room.left = left
+            room.right = right
+
+            left.role = "LEFT"
+            right.role = "RIGHT"
+            left.status = "PLAYING"
+            right.status = "PLAYING"
+
+            room.match_state = "PLAYING"
+            room.sim = sim = MatchSim(seed=self.rng.getrandbits(32))
+            if self.batch is not None:
+                self.batch.load(room.slot, sim.ly, sim.ry, sim.bx, sim.by,
+                                sim.vx, sim.vy, sim.sl, sim.sr)
+                self.batch.set_input(room.slot, False, left.up, left.down)
+                self.batch.set_input(room.slot, True, right.up, right.down)
+            self._watch(left, room)
+            self._watch(right, room)
+            self._relay_room(room)
+            if self.record_dir:
+                self._start_recording(room)
+            started = True
 
             try:
-                self.left.send_line("ROLE LEFT")
-                self.right.send_line("ROLE RIGHT")
-                self.left.send_line("MATCH PLAYING")
-                self.right.send_line("MATCH PLAYING")
+                left.send_line("ROLE LEFT")
+                right.send_line("ROLE RIGHT")
+                left.send_line("MATCH PLAYING")
+                right.send_line("MATCH PLAYING")
             except Exception:
                 pass
 
-        self._broadcast_lobby()
-
-    def _reset_game(self, full: bool):
-        self.ly = HEIGHT/2 - PADDLE_H/2
-        self.ry = HEIGHT/2 - PADDLE_H/2
-        self.bx = WIDTH/2
-        self.by = HEIGHT/2
-
-        sign = 1 if int(time.time()*1000) % 2 == 0 else -1
-        self.vx = BALL_SPEED * sign
-        self.vy = BALL_SPEED * (0.15 + (int(time.time()*1000) % 30)/100.0) * (1 if sign == 1 else -1)
-
-        if full:
-            self.sl = 0
-            self.sr = 0
+        if started:
+            for c in self.conns.values():
+                if c.role == "SPECTATOR" and c.room is None and not c.relay:
+                    self._auto_watch(c)
+                    try:
+                        c.send_line(f"MATCH {self._match_state_of(c)}")
+                    except Exception:
+                        pass
 
-    def _clamp(self, v, lo, hi):
-        return lo if v < lo else hi if v > hi else v
+        if started:
+            self._lobby_changed()
 
     def _game_loop(self):
-        last = time.time()
-        acc = 0.0
+        # Ticks are deadlines: select() sleeps until a socket is ready or the
+        # next tick is due, so idle connections cost nothing.
+        next_tick = time.monotonic()
 
         while self.running:
-            now = time.time()
-            dt = now - last
-            last = now
-            acc += dt
-
-            with self.lock:
-                conns_list = list(self.conns.values())
-            for c in conns_list:
-                try:
-                    for line in self._recv_lines(c):
-                        self._handle_line(c, line)
-                except Exception:
-                    self._drop_conn(c.sock)
+            timeout = next_tick - time.monotonic()
+            events = self.sel.select(timeout if timeout > 0 else 0)
+            for key, mask in events:
+                if key.data is None:
+                    self._accept()
+                    continue
+                if type(key.data) is not Conn:
+                    key.data.handle(key.fileobj, mask)  # metrics or directory
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(key.data)
+                if mask & selectors.EVENT_READ:
+                    self._on_readable(key.data)
+
+            now = time.monotonic()
+            if now < next_tick:
+                continue
 
+            m = self.metrics
+            lag = now - next_tick
+            m.lag.observe(lag)
+            if lag > DT:
+                self.counters["tick_overruns"] += 1
+            t0 = time.perf_counter()
+
+            self._resume_reads()
+            self._apply_inputs()
+            if self.udp is not None and self.tick % TICK_HZ == 0:
+                self._expire_udp()
             self._maybe_start_match()
 
-            while acc >= DT:
-                acc -= DT
+            steps = 0
+            while now >= next_tick and steps < MAX_CATCHUP_STEPS:
                 self._step(DT)
-
+                next_tick += DT
+                steps += 1
+            if now >= next_tick:
+                # fell too far behind; drop the backlog instead of spiralling
+                next_tick = now + DT
+                self.counters["tick_resets"] += 1
+            t1 = time.perf_counter()
+            m.step.observe(t1 - t0)
+
+            if self.stats is not None:
+                self._apply_stats()
+            self._flush_lobby()
+            self._flush_chat()
             self._broadcast_state()
-
-            time.sleep(0.004)
+            t2 = time.perf_counter()
+            m.broadcast.observe(t2 - t1)
+            self._flush_all()
+            t3 = time.perf_counter()
+            m.flush.observe(t3 - t2)
+            m.tick.observe(t3 - t0)
+
+    def _on_readable(self, c: Conn):
+        if c.sock not in self.conns:
+            return  # dropped earlier in this batch of events
+        try:
+            msgs = self._recv_lines(c)
+            n = self._spend(c, len(msgs))
+            if n < len(msgs):
+                msgs = self._shed(c, msgs, n)
+                if not self._throttle(c):
+                    print(f"[SERVER] Dropping flooding client: {c.addr}")
+                    self._drop_conn(c.sock)
+                    return
+            self._dispatch(c, msgs)
+        except Exception:
+            self._drop_conn(c.sock)
+
+    def _dispatch(self, c: Conn, msgs: list):
+        m = self.metrics
+        for i, msg in enumerate(msgs):
+            if c.held is not None:
+                # HELLO is waiting on the directory; the rest follows it in _on_claim
+                c.held.extend(msgs[i:])
+                return
+            if isinstance(msg, str):
+                cmd = protocol.parse_command(msg) if msg else None
+                m.count_in(cmd.cmd if cmd else "OTHER", len(msg) + 1)
+                if cmd:
+                    self._handle_command(c, cmd)
+            else:
+                kind, payload = msg
+                m.count_in(protocol.FRAME_NAMES.get(kind, "OTHER"), len(payload) + protocol.FRAME_HDR.size)
+                self._handle_frame(c, kind, payload)
+
+    def _spend(self, c: Conn, n: int) -> int:
+        """Count ``n`` messages against this tick's budget; returns how many fit."""
+        if c.cmd_tick != self.tick:
+            c.cmd_tick = self.tick
+            c.cmds = 0
+        c.cmds += n
+        return n - min(n, max(0, c.cmds - CMD_BUDGET))
+
+    def _shed(self, c: Conn, msgs: list, n: int) -> list:
+        """The messages of an over-budget read that are still handled.
+
+        Inputs and ACKs only matter as their latest value, so the last of
+        each kind is kept wherever it sits and the earlier ones are skipped
+        unparsed. Other commands keep their order and get the ``n`` slots.
+        """
+        last = {}
+        for i, msg in enumerate(msgs):
+            k = _latest_key(msg)
+            if k is not None:
+                last[k] = i
+        kept = []
+        coalesced = dropped = 0
+        for i, msg in enumerate(msgs):
+            k = _latest_key(msg)
+            if k is not None:
+                if last[k] == i:
+                    kept.append(msg)
+                else:
+                    coalesced += 1
+            elif n > 0:
+                kept.append(msg)
+                n -= 1
+            else:
+                dropped += 1
+        self.counters["inputs_coalesced"] += coalesced
+        if dropped:
+            self.counters["commands_dropped"] += dropped
+            try:
+                c.send_line(f"CHAT Server: Too many messages; {dropped} were ignored.")
+            except Exception:
+                pass
+        return kept
+
+    def _throttle(self, c: Conn) -> bool:
+        """Stop reading ``c`` until the next tick; False once it has flooded for FLOOD_TICKS."""
+        c.flood_ticks = c.flood_ticks + 1 if c.flood_tick == self.tick - 1 else 1
+        c.flood_tick = self.tick
+        if c.flood_ticks >= FLOOD_TICKS:
+            self.counters["flood_disconnects"] += 1
+            return False
+        self.counters["clients_throttled"] += 1
+        c.paused = True
+        self._paused.append(c)
+        self._set_events(c)
+        return True
+
+    def _resume_reads(self):
+        for c in self._paused:
+            c.paused = False
+            if c.sock in self.conns:
+                self._set_events(c)
+        self._paused.clear()
+
+    def _queue_input(self, c: Conn, up: int, down: int, seq: int):
+        # only the last state before a step matters; seq stays the newest one sent
+        prev = c.next_input
+        if prev is None:
+            self._inputs.append(c)
+        else:
+            self.counters["inputs_coalesced"] += 1
+            seq = seq or prev[2]
+        c.next_input = (up, down, seq)
+
+    def _apply_inputs(self):
+        for c in self._inputs:
+            if c.next_input is not None and c.sock in self.conns:
+                self._set_input(c, *c.next_input)
+            c.next_input = None
+        self._inputs.clear()
+
+    def _on_datagram(self, c: Conn, addr: tuple, kind: int, payload: bytes):
+        if c.sock not in self.conns:
+            return
+        if not self._spend(c, 1) and kind != protocol.T_INPUT:
+            self.counters["commands_dropped"] += 1  # inputs are folded, never shed
+            return
+        self.metrics.count_in(f"UDP_{protocol.FRAME_NAMES.get(kind, 'OTHER')}",
+                              len(payload) + protocol.UDP_TOKEN.size + protocol.FRAME_HDR.size)
+        if kind == protocol.T_BIND:
+            c.udp_addr = addr
+            c.udp_seen = time.monotonic()
+            self.udp.send(addr, BIND_FRAME)
+        elif kind == protocol.T_INPUT and addr == c.udp_addr:
+            c.udp_seen = time.monotonic()
+            try:
+                up, down, seq = protocol.decode_input(payload)
+            except Exception:
+                return
+            # resent until acknowledged, and datagrams may be reordered
+            if seq <= (c.next_input[2] if c.next_input else c.input_seq):
+                self.counters["udp_stale"] += 1
+                return
+            self._queue_input(c, up, down, seq)
+
+    def _state_line(self, sim: MatchSim, al: int, ar: int) -> bytes:
+        return self._encode(f"STATE t={self.tick} ly={sim.ly:.2f} ry={sim.ry:.2f} "
+                            f"bx={sim.bx:.2f} by={sim.by:.2f} sl={sim.sl} sr={sim.sr} al={al} ar={ar}")
+
+    def _expire_udp(self):
+        # the path or a NAT mapping can vanish silently; snapshots go back to TCP
+        now = time.monotonic()
+        for c in self.conns.values():
+            if c.udp and now - c.udp_seen > UDP_TIMEOUT:
+                c.udp = False
+                self.counters["udp_fallbacks"] += 1
+                try:
+                    c.send_line("UDP OFF")
+                except Exception:
+                    pass
 
     def _broadcast_state(self):
-        if self.match_state in ("PLAYING", "ENDED"):
-            line = f"STATE ly={self.ly:.2f} ry={self.ry:.2f} bx={self.bx:.2f} by={self.by:.2f} sl={self.sl} sr={self.sr}"
-            dead = []
-            with self.lock:
-                for cs, c in self.conns.items():
-                    try:
-                        c.send_line(line)
-                    except Exception:
-                        dead.append(cs)
-            for cs in dead:
-                self._drop_conn(cs)
+        if self.tick - self._last_snapshot_tick < self.snapshot_every:
+            return
+        self._last_snapshot_tick = self.tick
+        for room in self._active_rooms():
+            if self.batch is not None and room.match_state == "PLAYING" and room.replay is None:
+                self._sync_room(room)
+            sim = room.sim
+            al = room.left.input_seq if room.left else 0
+            ar = room.right.input_seq if room.right else 0
+            snap = protocol.quantize(*sim.state()) + (al, ar)
+            if snap == room._last_snap:
+                # a lost datagram is never resent; repeat the last one now and then
+                if room.udp_state is not None and self.tick - room.udp_at >= UDP_REPEAT:
+                    room.udp_at = self.tick
+                    for c in room.viewers:
+                        if c.udp:
+                            self.udp.send(c.udp_addr, room.udp_state)
+                continue
+            room._last_snap = snap
+            room.snapshots[self.tick] = snap
+            if len(room.snapshots) > SNAPSHOT_HISTORY:
+                del room.snapshots[next(iter(room.snapshots))]
+
+            line = None
+            full = None
+            deltas = {}  # baseline tick -> frame; viewers mostly share a baseline
+            n_line = n_full = n_delta = delta_bytes = n_udp = 0
+            for c in room.viewers:
+                try:
+                    if c.udp:
+                        if full is None:
+                            full = protocol.encode_state(self.tick, *sim.state(), al, ar)
+                            self.counters["bytes_encoded"] += len(full)
+                        if self.udp.send(c.udp_addr, full):
+                            n_udp += 1
+                    elif c.proto == protocol.PROTO_DELTA:
+                        base_tick = c.acked if c.acked in room.snapshots else 0
+                        data = deltas.get(base_tick)
+                        if data is None:
+                            data = protocol.encode_delta(self.tick, base_tick, room.snapshots.get(base_tick), snap)
+                            deltas[base_tick] = data
+                            self.counters["bytes_encoded"] += len(data)
+                        c.send_bytes(data, droppable=True)
+                        n_delta += 1
+                        delta_bytes += len(data)
+                    elif c.proto == protocol.PROTO_BIN:
+                        if full is None:
+                            full = protocol.encode_state(self.tick, *sim.state(), al, ar)
+                            self.counters["bytes_encoded"] += len(full)
+                        c.send_bytes(full, droppable=True)
+                        n_full += 1
+                    else:
+                        if line is None:
+                            line = self._state_line(sim, al, ar)
+                        c.send_bytes(line, droppable=True)
+                        n_line += 1
+                except SlowConsumer:
+                    pass
+            if self._relays:
+                if line is None:
+                    line = self._state_line(sim, al, ar)
+                self._fanout(f"ROOM {room.rid} ".encode() + line, self._relays, droppable=True,
+                             kind="ROOM", stream=room.rid)
+            room.udp_state = full if n_udp else None
+            room.udp_at = self.tick
+            m = self.metrics
+            if n_udp:
+                self.counters["bytes_sent"] += len(full) * n_udp
+                m.count_out("UDP_STATE", len(full) * n_udp, n_udp)
+            if n_line:
+                m.count_out("STATE", len(line) * n_line, n_line)
+            if n_full:
+                m.count_out("STATE", len(full) * n_full, n_full)
+            if n_delta:
+                m.count_out("DELTA", delta_bytes, n_delta)
+
+    def _handle_command(self, c: Conn, cmd):
+        kind = type(cmd)
+        if kind is protocol.Hello:
+            name = cmd.name
+            if name in self.name_map:
+                try:
+                    c.send_line("ERROR NameTaken")
+                except Exception:
+                    pass
+                return
+            if self.directory is not None:
+                # other workers may hold the name; finish in _on_claim
+                cid = self._next_claim
+                self._next_claim += 1
+                self._claims[cid] = (c, name)
+                self.directory.claim(cid, name)
+                c.held = []  # and stop reading until the answer
+                self._set_events(c)
+                return
+            self._hello(c, name)
+            return
 
-    def _handle_line(self, c: Conn, line: str):
-        if not line:
+        if kind is protocol.Relay:
+            # every room's stream is costly to feed, so only configured relays get it
+            if self.relay_token and hmac.compare_digest(cmd.token.encode(), self.relay_token.encode()):
+                self._add_relay(c)
+            else:
+                try:
+                    c.send_line("ERROR RelayDenied")
+                except Exception:
+                    pass
             return
-        if line.startswith("HELLO "):
-            name = line[6:].strip()
-            if not name:
+
+        if kind is protocol.Input:
+            if c.name:
+                up, down, _ = c.next_input or (c.up, c.down, 0)
+                if cmd.key == "UP":
+                    up = cmd.down
+                else:
+                    down = cmd.down
+                self._queue_input(c, up, down, cmd.seq)
+            return
+
+        if kind is protocol.Command:
+            if cmd.cmd == "STATS":
+                # allowed before HELLO so monitoring probes need not join the lobby
+                try:
+                    c.send_line(f"STATS {self.metrics.summary()}")
+                except Exception:
+                    pass
                 return
-            with self.lock:
-                if name in self.name_map:
+            if cmd.cmd == "UDP":
+                if self.udp is not None and c.name:
+                    if not c.udp_token:
+                        c.udp_token = self.udp.open(c)
                     try:
-                        c.send_line("ERROR NameTaken")
+                        c.send_line(f"UDP {self.udp.port} {c.udp_token}")
                     except Exception:
                         pass
-                    return
-                c.name = name
-                self.name_map[name] = c
+                return
+            if cmd.cmd == "UDP_READY":
+                # the client got our BIND back, so datagrams flow both ways
+                if c.udp_addr is not None:
+                    c.udp = True
+                    c.udp_seen = time.monotonic()
+                return
+            if cmd.cmd == "LOBBY":
+                # a client that missed a LOBBY_* version resyncs here
+                if c.name or c.relay:
+                    c.lobby = True  # only versioned clients ask
+                    try:
+                        self._send_lobby(c)
+                    except Exception:
+                        pass
+                return
+
+        if not c.name:
+            return
+
+        if kind is protocol.Proto:
+            c.proto = protocol.negotiate(cmd.offered)
+            lobby = protocol.LOBBY_DELTAS in cmd.offered
             try:
-                c.send_line("ROLE SPECTATOR")
-                c.send_line(f"MATCH {self.match_state}")
-                c.send_line("CHAT Server: Welcome! Click 'Request to play' to join queue.")
+                c.send_line(f"PROTO {c.proto} {protocol.LOBBY_DELTAS}" if lobby else f"PROTO {c.proto}")
+                if lobby and not c.lobby:
+                    c.lobby = True
+                    self._send_lobby(c)  # replaces the unversioned one sent at HELLO
             except Exception:
                 pass
-            self._broadcast_lobby()
             return
 
-        if not c.name:
+        if kind is protocol.Chat:
+            now = time.monotonic()
+            c.chat_tokens = min(CHAT_BURST, c.chat_tokens + (now - c.chat_at) * CHAT_RATE)
+            c.chat_at = now
+            if c.chat_tokens < 1.0:
+                self.counters["chat_limited"] += 1
+                try:
+                    c.send_line("CHAT Server: You are sending messages too fast.")
+                except Exception:
+                    pass
+                return
+            c.chat_tokens -= 1.0
+            self._chat.append(self._encode(f"CHAT {c.name}: {cmd.text[:protocol.CHAT_MAX_LEN]}"))
             return
 
-        if line == "REQ_PLAY":
-            with self.lock:
-                if c.status == "PLAYING":
-                    return
-                if c not in self.queue:
-                    self.queue.append(c)
-                c.status = "QUEUED"
-            self._broadcast_lobby()
+        if kind is protocol.Watch:
+            if c.status == "PLAYING":
+                return
+            room = self.rooms.get(cmd.rid)
+            if room is None or not room.active:
+                return
+            self._watch(c, room)
+            try:
+                c.send_line(f"MATCH {room.match_state}")
+            except Exception:
+                pass
             return
 
-        if line == "CANCEL_PLAY":
-            with self.lock:
-                if c in self.queue:
-                    try:
-                        self.queue.remove(c)
-                    except ValueError:
-                        pass
-                if c.status != "PLAYING":
-                    c.status = "WAITING"
-            self._broadcast_lobby()
+        if kind is protocol.Replay:
+            if c.status == "PLAYING":
+                return
+            err = self._start_replay(c, cmd.args)
+            if err:
+                try:
+                    c.send_line(f"ERROR {err}")
+                except Exception:
+                    pass
             return
 
-        if line.startswith("INPUT "):
-            parts = line.split()
-            if len(parts) >= 3:
-                key = parts[1].upper()
-                val = 1 if parts[2] == "1" else 0
-                if key == "UP":
-                    c.up = val
-                elif key == "DOWN":
-                    c.down = val
-            return
+        name = cmd.cmd
+        if name == "REQ_PLAY":
+            if c.status == "PLAYING":
+                return
+            if self.queue.add(c):
+                self._queue_dirty = True
+            c.status = "QUEUED"
+            self._lobby_changed()
+        elif name == "CANCEL_PLAY":
+            if self.queue.discard(c):
+                self._queue_dirty = True
+            if c.status != "PLAYING":
+                c.status = "WAITING"
+            self._lobby_changed()
+        elif name == "ROOMS":
+            items = [f"{r.rid}|{r.left.name}|{r.right.name}|{r.sim.sl}|{r.sim.sr}"
+                     for r in self._active_rooms() if r.left and r.right]
+            try:
+                c.send_line(f"ROOMS {';'.join(items)}")
+            except Exception:
+                pass
+        elif name == "LEADERBOARD":
+            board = self.stats.leaderboard() if self.stats is not None else ""
+            try:
+                c.send_line(f"LEADERBOARD {board}")
+            except Exception:
+                pass
+        elif name == "RECORDINGS":
+            names = list_recordings(self.record_dir)[:50] if self.record_dir else []
+            try:
+                c.send_line(f"RECORDINGS {';'.join(names)}")
+            except Exception:
+                pass
+
+    def _hello(self, c: Conn, name: str):
+        c.name = name
+        self.name_map[name] = c
+        try:
+            c.send_line("ROLE SPECTATOR")
+            c.send_line(f"MATCH {self._match_state_of(c)}")
+            if self._chat_history:
+                c.send_bytes(b"".join(self._chat_history))
+            c.send_line("CHAT Server: Welcome! Click 'Request to play' to join queue.")
+            self._send_lobby(c)
+        except Exception:
+            pass
+        if self.stats is not None:
+            self.stats.load(name)  # rating arrives through _apply_stats
+        self._lobby_changed()
 
-        if line.startswith("CHAT "):
-            msg = line[5:].strip()
-            if msg:
-                self._broadcast(f"CHAT {c.name}: {msg}")
+    def _handle_frame(self, c: Conn, kind: int, payload: bytes):
+        if not c.name:
             return
+        if kind == protocol.T_INPUT:
+            try:
+                up, down, seq = protocol.decode_input(payload)
+            except Exception:
+                return
+            self._queue_input(c, up, down, seq)
+        elif kind == protocol.T_ACK:
+            try:
+                t = protocol.decode_ack(payload)
+            except Exception:
+                return
+            # only baselines sent since joining the current room are usable
+            if c.room and t > c.watch_tick and t in c.room.snapshots and t > c.acked:
+                c.acked = t
+
+    def _set_input(self, c: Conn, up: int, down: int, seq: int = 0):
+        c.up, c.down = up, down
+        # echoed as u32 in every snapshot; a bad value must not reach the packers
+        if 0 < seq <= protocol.SEQ_MAX:
+            c.input_seq = seq
+        room = c.room
+        if self.batch is not None and room and c.status == "PLAYING":
+            self.batch.set_input(room.slot, c is room.right, up, down)
 
     def _step(self, dt: float):
-        if self.match_state == "ENDED":
-            if time.time() - self._ended_at > 0.8:
-                with self.lock:
-                    if self.left:
-                        self.left.role = "SPECTATOR"
-                        self.left.status = "WAITING"
-                        try:
-                            self.left.send_line("ROLE SPECTATOR")
-                            self.left.send_line("MATCH WAITING")
-                        except Exception:
-                            pass
-                    if self.right:
-                        self.right.role = "SPECTATOR"
-                        self.right.status = "WAITING"
-                        try:
-                            self.right.send_line("ROLE SPECTATOR")
-                            self.right.send_line("MATCH WAITING")
-                        except Exception:
-                            pass
-                    self.left = None
-                    self.right = None
-                    self.match_state = "WAITING"
-                    self._reset_game(full=True)
-                self._broadcast_lobby()
+        self.tick += 1
+        if self.batch is None:
+            for room in self._active_rooms():
+                self._step_room(room, dt)
+        else:
+            for slot, winner in self.batch.step(dt):
+                room = self._slots[slot]
+                self._sync_room(room)
+                self._end_match(room, winner)
+            for room in list(self._ending):
+                self._step_room(room, dt)
+        for room in list(self._replays):
+            self._step_replay(room)
+        if self._recording:
+            self._record_tick()
+
+    def _sync_room(self, room: Room):
+        sim = room.sim
+        sim.ly, sim.ry, sim.bx, sim.by, sim.sl, sim.sr = self.batch.read(room.slot)
+
+    def _step_room(self, room: Room, dt: float):
+        if room.match_state == "ENDED":
+            if time.time() - room._ended_at > 0.8:
+                for p in (room.left, room.right):
+                    if not p:
+                        continue
+                    p.role = "SPECTATOR"
+                    p.status = "WAITING"
+                    try:
+                        p.send_line("ROLE SPECTATOR")
+                    except Exception:
+                        pass
+                self._close_room(room)
+                self._lobby_changed()
             return
 
-        if self.match_state != "PLAYING":
+        if room.match_state != "PLAYING" or room.replay is not None:
             return
 
-        left = self.left
-        right = self.right
+        left = room.left
+        right = room.right
         if not left or not right:
-            self.match_state = "WAITING"
+            room.match_state = "WAITING"
+            self._queue_dirty = True
             return
 
-        self.ly += (left.down - left.up) * PADDLE_SPEED * dt
-        self.ry += (right.down - right.up) * PADDLE_SPEED * dt
-        self.ly = self._clamp(self.ly, 0, HEIGHT - PADDLE_H)
-        self.ry = self._clamp(self.ry, 0, HEIGHT - PADDLE_H)
-
-        self.bx += self.vx * dt
-        self.by += self.vy * dt
-
-        if self.by - BALL_R <= 0:
-            self.by = BALL_R
-            self.vy *= -1
-        elif self.by + BALL_R >= HEIGHT:
-            self.by = HEIGHT - BALL_R
-            self.vy *= -1
-
-        lx = PADDLE_MARGIN
-        rx = WIDTH - PADDLE_MARGIN - PADDLE_W
-
-        if self.vx < 0 and self.bx - BALL_R <= lx + PADDLE_W:
-            if self.ly <= self.by <= self.ly + PADDLE_H:
-                self.bx = lx + PADDLE_W + BALL_R
-                self.vx *= -1
-                rel = (self.by - (self.ly + PADDLE_H/2)) / (PADDLE_H/2)
-                self.vy = BALL_SPEED * 0.65 * rel
-
-        if self.vx > 0 and self.bx + BALL_R >= rx:
-            if self.ry <= self.by <= self.ry + PADDLE_H:
-                self.bx = rx - BALL_R
-                self.vx *= -1
-                rel = (self.by - (self.ry + PADDLE_H/2)) / (PADDLE_H/2)
-                self.vy = BALL_SPEED * 0.65 * rel
-
-        if self.bx < -30:
-            self.sr += 1
-            if self.sr >= WIN_SCORE:
-                self._end_match(winner="RIGHT")
-            else:
-                self._reset_game(full=False)
-                self.vx = abs(self.vx)
-            return
+        room.sim.step(dt, left.down - left.up, right.down - right.up)
+        if room.sim.winner:
+            self._end_match(room, room.sim.winner)
 
-        if self.bx > WIDTH + 30:
-            self.sl += 1
-            if self.sl >= WIN_SCORE:
-                self._end_match(winner="LEFT")
-            else:
-                self._reset_game(full=False)
-                self.vx = -abs(self.vx)
+    # ---- recording and replay ----
+
+    def _start_recording(self, room: Room):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-r{room.rid}-{room.sim.seed}"
+        try:
+            room.recorder = Recorder(os.path.join(self.record_dir, name), room.sim.seed,
+                                     room.left.name, room.right.name)
+        except OSError as e:
+            print(f"[SERVER] Not recording room {room.rid}: {e}")
             return
+        self._recording.add(room)
 
-    def _end_match(self, winner: str):
-        self.match_state = "ENDED"
-        self._ended_at = time.time()
-        self._broadcast(f"END winner={winner} sl={self.sl} sr={self.sr}")
-        with self.lock:
-            if self.left:
-                try:
-                    self.left.send_line("MATCH ENDED")
-                except Exception:
-                    pass
-            if self.right:
+    def _stop_recording(self, room: Room):
+        self._recording.discard(room)
+        try:
+            room.recorder.close()
+        except OSError:
+            pass
+        room.recorder = None
+
+    def _record_tick(self):
+        # one struct pack per playing room; with batch physics, columns are
+        # pulled out of the arrays once instead of per room
+        if self.batch is None:
+            for room in list(self._recording):
+                l, r = room.left, room.right
+                self._record(room, *room.sim.state(), input_bits(l.up, l.down, r.up, r.down))
+            return
+        b = self.batch
+        ly, ry, bx, by, sl, sr = (a.tolist() for a in (b.ly, b.ry, b.bx, b.by, b.sl, b.sr))
+        for room in list(self._recording):
+            i = room.slot
+            l, r = room.left, room.right
+            self._record(room, ly[i], ry[i], bx[i], by[i], sl[i], sr[i],
+                         input_bits(l.up, l.down, r.up, r.down))
+
+    def _record(self, room: Room, *frame):
+        try:
+            room.recorder.append(*frame)
+        except OSError as e:
+            # a full disk costs this recording, not the match or the server
+            print(f"[SERVER] Stopped recording room {room.rid}: {e}")
+            self._stop_recording(room)
+
+    def _start_replay(self, c: Conn, args: list[str]) -> str | None:
+        if not self.record_dir or not args:
+            return "NoSuchRecording"
+        name = args[0]
+        if name not in list_recordings(self.record_dir):
+            return "NoSuchRecording"
+        try:
+            speed = min(32.0, max(0.1, float(args[1]))) if len(args) > 1 else 1.0
+        except ValueError:
+            return "BadSpeed"
+        prev = next((r for r in self._replay_rooms() if r.replay_owner is c), None)
+        if prev is not None:
+            self._close_room(prev)
+        room = self._free_room()
+        if room is None:
+            return "NoFreeRoom"
+        try:
+            pb = Playback(os.path.join(self.record_dir, name))
+        except (OSError, ValueError):
+            return "NoSuchRecording"
+        if not pb.ticks:
+            pb.close()
+            return "NoSuchRecording"
+
+        start = 0
+        if len(args) > 2:
+            try:
+                if args[2].startswith("g"):
+                    goal = int(args[2][1:])
+                    if goal < 1:
+                        raise IndexError(goal)  # goals count from 1; don't index from the end
+                    start = pb.goals[goal - 1][0]  # first tick after that goal
+                else:
+                    start = int(args[2])
+            except (ValueError, IndexError):
+                start = 0
+        start = min(max(0, start), pb.ticks - 1)
+
+        room.replay = pb
+        room.replay_owner = c
+        room.replay_speed = speed
+        room.replay_pos = start - speed  # the next _step lands on ``start``
+        room.match_state = "PLAYING"
+        self._replays.add(room)
+        self._step_replay(room)
+        self._relay_room(room)
+        self._watch(c, room)
+        try:
+            c.send_line("MATCH PLAYING")
+            c.send_line(f"CHAT Server: Replay {name} ({pb.left} vs {pb.right}) at {speed:g}x from tick {start}.")
+        except Exception:
+            pass
+        return None
+
+    def _replay_rooms(self) -> list[Room]:
+        # includes replays that reached the end and are showing the result
+        return [r for r in self.rooms.values() if r.replay is not None]
+
+    def _step_replay(self, room: Room):
+        pb = room.replay
+        room.replay_pos += room.replay_speed
+        i = int(room.replay_pos)
+        last = i >= pb.ticks - 1
+        _, ly, ry, bx, by, sl, sr, _ = pb.frame(pb.ticks - 1 if last else i)
+        sim = room.sim
+        sim.ly, sim.ry, sim.bx, sim.by, sim.sl, sim.sr = ly, ry, bx, by, sl, sr
+        if last:
+            self._replays.discard(room)
+            self._end_match(room, "LEFT" if sl > sr else "RIGHT" if sr > sl else "NONE")
+
+    def _apply_stats(self):
+        for p in self.stats.poll():
+            c = self.name_map.get(p.name)
+            if c is not None:
+                c.rating = p.rating
+
+    def _end_match(self, room: Room, winner: str):
+        room.match_state = "ENDED"
+        room._ended_at = time.time()
+        self._ending.add(room)
+        if room.recorder is not None:
+            # the deciding tick; _record_tick only sees rooms still playing
+            l, r = room.left, room.right
+            self._record(room, *room.sim.state(), input_bits(l.up, l.down, r.up, r.down))
+            if room.recorder is not None:
+                self._stop_recording(room)
+        end = f"END winner={winner} sl={room.sim.sl} sr={room.sim.sr}"
+        if self.stats is not None and room.replay is None and winner in ("LEFT", "RIGHT"):
+            w, l = (room.left, room.right) if winner == "LEFT" else (room.right, room.left)
+            ws, ls = (room.sim.sl, room.sim.sr) if winner == "LEFT" else (room.sim.sr, room.sim.sl)
+            if w and l:
+                self.stats.record(w.name, l.name, ws, ls)
+        self._broadcast(end, room.viewers)
+        if self._relays:
+            self._relay_room(room)
+            self._broadcast(f"ROOM {room.rid} {end}", self._relays)
+        for p in (room.left, room.right):
+            if p:
                 try:
-                    self.right.send_line("MATCH ENDED")
+                    p.send_line("MATCH ENDED")
                 except Exception:
                     pass
 
 def main():
-    import sys
-    host = HOST_DEFAULT
-    port = PORT_DEFAULT
-    if len(sys.argv) >= 2:
-        host = sys.argv[1]
-    if len(sys.argv) >= 3:
-        port = int(sys.argv[2])
-    PongServer(host, port).start()
+    import argparse
+    ap = argparse.ArgumentParser(description="Classic Pong server")
+    ap.add_argument("host", nargs="?", default=HOST_DEFAULT)
+    ap.add_argument("port", nargs="?", type=int, default=PORT_DEFAULT)
+    ap.add_argument("--snapshot-hz", type=int, default=SNAPSHOT_HZ,
+                    help=f"STATE broadcasts per second (default {SNAPSHOT_HZ}, max {TICK_HZ})")
+    ap.add_argument("--max-rooms", type=int, default=MAX_ROOMS,
+                    help=f"concurrent matches hosted by this process (default {MAX_ROOMS})")
+    ap.add_argument("--batch-physics", action="store_true",
+                    help="step all matches together with NumPy (pong/batch.py)")
+    ap.add_argument("--seed", type=int, default=None,
+                    help="seed for match serves, for reproducible runs")
+    ap.add_argument("--metrics-port", type=int, default=None,
+                    help="serve Prometheus metrics on 127.0.0.1:PORT/metrics (worker N uses PORT+N)")
+    ap.add_argument("--record-dir", default=None,
+                    help="record every match here; REPLAY <name> streams one back")
+    ap.add_argument("--matchmaker", choices=("fifo", "rating"), default="fifo",
+                    help="pair queued players in arrival order, or by similar rating (widening over time)")
+    ap.add_argument("--stats-db", default=None,
+                    help="keep wins/losses/rating per player in this SQLite file; enables LEADERBOARD")
+    ap.add_argument("--udp-port", type=int, default=None,
+                    help="also carry STATE and INPUT over UDP on this port for clients that ask "
+                         "(worker N uses PORT+N)")
+    ap.add_argument("--relay-token", default=None,
+                    help="accept relay.py subscribers that present this token (RELAY is refused without it)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="server processes sharing the port via SO_REUSEPORT (pong/shard.py)")
+    args = ap.parse_args()
+
+    def run(wid: int = 0, directory: DirectoryClient | None = None):
+        PongServer(args.host, args.port, max_rooms=args.max_rooms,
+                   snapshot_hz=args.snapshot_hz, batch_physics=args.batch_physics,
+                   seed=None if args.seed is None else args.seed + wid,
+                   metrics_port=None if args.metrics_port is None else args.metrics_port + wid,
+                   reuse_port=directory is not None, directory=directory,
+                   record_dir=args.record_dir, matchmaker=args.matchmaker,
+                   stats_db=args.stats_db,
+                   udp_port=None if args.udp_port is None else args.udp_port + wid,
+                   relay_token=args.relay_token).start()
+
+    if args.workers > 1:
+        serve_sharded(args.workers, run)
+    else:
+        run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+"""Scalar vs NumPy batch physics: equivalence check and matches per core.
+
+    python tools/bench_physics.py --matches 100 1000 5000
+
+Two headless PongServers (bound to an ephemeral localhost port, no
+clients) host the same matches driven by the same random paddle inputs;
+one steps each room's MatchSim, the other uses BatchPhysics. Both use the
+same seed, so serves match too. Every room is compared after every tick,
+then each engine is timed on its own.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from server import DT, TICK_HZ, Conn, PongServer
+
+
+def _host(n: int, batch: bool) -> tuple[PongServer, list[Conn]]:
+    srv = PongServer("127.0.0.1", 0, max_rooms=n, batch_physics=batch, seed=n)
+    players = []
+    for i in range(2 * n):
+        c = Conn(sock=object(), addr=("bench", i), name=f"p{i}")
+        srv.conns[c.sock] = c
+        srv.name_map[c.name] = c
+        srv.queue.add(c)
+        players.append(c)
+    srv._queue_dirty = True
+    srv._maybe_start_match()
+    return srv, players
+
+
+def _drive(srv: PongServer, players: list[Conn], rng: random.Random):
+    # a few paddles change direction every tick
+    for _ in range(max(1, len(players) // 20)):
+        c = players[rng.randrange(len(players))]
+        d = rng.randrange(3)
+        srv._set_input(c, int(d == 0), int(d == 1))
+
+
+def check(n: int, ticks: int) -> int:
+    a, pa = _host(n, batch=False)
+    b, pb = _host(n, batch=True)
+    ra, rb = random.Random(n), random.Random(n)
+    mismatches = 0
+    for _ in range(ticks):
+        _drive(a, pa, ra)
+        _drive(b, pb, rb)
+        a._step(DT)
+        b._step(DT)
+        for ra_room, rb_room in zip(a._slots, b._slots):
+            playing = (ra_room.match_state == "PLAYING", rb_room.match_state == "PLAYING")
+            if playing == (False, False):
+                continue  # finished; closing is wall-clock driven, so skip it
+            if playing[1]:
+                b._sync_room(rb_room)
+            if playing[0] != playing[1] or ra_room.sim.state() != rb_room.sim.state():
+                mismatches += 1
+    a.srv.close()
+    b.srv.close()
+    return mismatches
+
+
+def bench(n: int, batch: bool, ticks: int) -> float:
+    srv, players = _host(n, batch)
+    rng = random.Random(n)
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        _drive(srv, players, rng)
+        srv._step(DT)
+    elapsed = time.perf_counter() - t0
+    srv.srv.close()
+    return elapsed / ticks
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--matches", type=int, nargs="+", default=[100, 1000, 5000])
+    ap.add_argument("--ticks", type=int, default=600)
+    args = ap.parse_args()
+
+    print(f"{'matches':>8} {'mismatch':>9} {'scalar ms/tick':>15} {'batch ms/tick':>14} "
+          f"{'scalar matches/core':>20} {'batch matches/core':>19}")
+    for n in args.matches:
+        bad = check(n, min(args.ticks, 1200))
+        ts = bench(n, False, args.ticks)
+        tb = bench(n, True, args.ticks)
+        # matches one core can keep at TICK_HZ = matches * (tick budget / tick cost)
+        per_core = lambda t: int(n * (1.0 / TICK_HZ) / t)
+        print(f"{n:>8} {bad:>9} {ts*1000:>15.3f} {tb*1000:>14.3f} {per_core(ts):>20} {per_core(tb):>19}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Synthetic load: drive N bot clients against a running server.
+
+    python server.py 127.0.0.1 5555 &
+    python tools/loadgen.py --clients 500 --players 40 --duration 30 --server-pid $!
+
+Every client speaks the normal protocol (HELLO, optional PROTO, REQ_PLAY,
+INPUT, CHAT) from one selector loop in this process. Players queue for
+matches and wiggle their paddle on a script; spectators only listen. At
+the end a summary is printed as JSON, or one CSV row per client:
+
+  state_interval_ms  gaps between STATE arrivals (all clients)
+  jitter_ms          per-client standard deviation of those gaps
+  fanout_ms          per tick, how long after the first client each other
+                     client received the same snapshot
+  chat_rtt_ms        CHAT round trip through the server's loop
+  server_cpu_pct     from /proc/<pid>/stat when --server-pid is given
+  dropped            connections the server closed or reset
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import selectors
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pong import protocol
+
+
+class Bot:
+    def __init__(self, idx: int, player: bool, rng: random.Random):
+        self.idx = idx
+        self.name = f"lg{idx}"
+        self.player = player
+        self.rng = rng
+        self.sock: socket.socket | None = None
+        self.framer = protocol.Framer(protocol.MAX_SERVER_LINE)
+        self.out = bytearray()
+        self.proto = "text"
+        self.role = "SPECTATOR"
+        self.connected = False
+        self.ready = False  # non-blocking connect finished
+        self.dropped = False
+
+        self.arrivals: list[tuple[int, float]] = []  # (tick, recv time)
+        self.chat_rtt: list[float] = []
+        self.chat_sent: dict[int, float] = {}
+        self.chat_seq = 0
+        self.next_input = 0.0
+        self.next_chat = 0.0
+        self.up = 0
+        self.down = 0
+
+    def send_line(self, line: str):
+        self.out += protocol.encode_line(line)
+
+
+def percentiles(vals: list[float]) -> dict:
+    if not vals:
+        return {"n": 0}
+    vals = sorted(vals)
+    pick = lambda q: vals[min(len(vals) - 1, int(q * len(vals)))]
+    return {"n": len(vals), "mean": round(statistics.fmean(vals), 3), "p50": round(pick(0.50), 3),
+            "p90": round(pick(0.90), 3), "p99": round(pick(0.99), 3), "max": round(vals[-1], 3)}
+
+
+def cpu_seconds(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class LoadGen:
+    def __init__(self, args):
+        self.args = args
+        self.sel = selectors.DefaultSelector()
+        rng = random.Random(args.seed)
+        self.bots = [Bot(i, i < args.players, random.Random(rng.getrandbits(32)))
+                     for i in range(args.clients)]
+
+    def _open(self, b: Bot):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            s.connect_ex((self.args.host, self.args.port))
+        except OSError:
+            b.dropped = True
+            return
+        b.sock = s
+        b.connected = True
+        b.send_line(f"HELLO {b.name}")
+        b.send_line(f"PROTO {self.args.proto} {protocol.LOBBY_DELTAS}")  # like the Tk client
+        if b.player:
+            b.send_line("REQ_PLAY")
+        now = time.time()
+        b.next_input = now + b.rng.random()
+        b.next_chat = now + b.rng.expovariate(self.args.chat_rate) if self.args.chat_rate > 0 else float("inf")
+        self.sel.register(s, selectors.EVENT_READ | selectors.EVENT_WRITE, b)
+
+    def _drop(self, b: Bot):
+        if b.sock is None:
+            return
+        try:
+            self.sel.unregister(b.sock)
+        except (KeyError, ValueError):
+            pass
+        b.sock.close()
+        b.sock = None
+        b.dropped = True
+
+    def _on_line(self, b: Bot, line: str, now: float):
+        if line.startswith("STATE"):
+            for p in line.split():
+                if p.startswith("t="):
+                    b.arrivals.append((int(p[2:]), now))
+                    break
+        elif line.startswith("ROLE "):
+            b.role = line[5:].strip()
+            if b.role == "SPECTATOR" and b.player:
+                b.send_line("REQ_PLAY")  # back in the queue after each match
+        elif line.startswith("PROTO "):
+            b.proto = line.split()[1]
+        elif line.startswith(f"CHAT {b.name}: lg "):
+            try:
+                seq = int(line.rsplit(" ", 1)[1])
+            except ValueError:
+                return
+            sent = b.chat_sent.pop(seq, None)
+            if sent is not None:
+                b.chat_rtt.append((now - sent) * 1000.0)
+
+    def _on_frame(self, b: Bot, kind: int, payload: bytes, now: float):
+        if kind == protocol.T_STATE:
+            b.arrivals.append((protocol.decode_state(payload)[0], now))
+        elif kind == protocol.T_DELTA:
+            tick = protocol.DELTA_HDR.unpack_from(payload)[0]
+            b.arrivals.append((tick, now))
+            b.out += protocol.encode_ack(tick)
+
+    def _script(self, b: Bot, now: float):
+        if b.player and b.role in ("LEFT", "RIGHT") and now >= b.next_input:
+            b.next_input = now + self.args.input_interval * (0.5 + b.rng.random())
+            up, down = [(1, 0), (0, 1), (0, 0)][b.rng.randrange(3)]
+            if b.proto != "text":
+                b.out += protocol.encode_input(up, down)
+            else:
+                if up != b.up:
+                    b.send_line(f"INPUT UP {up}")
+                if down != b.down:
+                    b.send_line(f"INPUT DOWN {down}")
+            b.up, b.down = up, down
+        if now >= b.next_chat:
+            b.next_chat = now + b.rng.expovariate(self.args.chat_rate)
+            b.chat_seq += 1
+            b.chat_sent[b.chat_seq] = now
+            b.send_line(f"CHAT lg {b.chat_seq}")
+
+    def run(self) -> dict:
+        args = self.args
+        pid = args.server_pid
+        cpu0 = cpu_seconds(pid) if pid else None
+        start = time.time()
+        ramp_gap = 1.0 / args.ramp if args.ramp > 0 else 0.0
+        pending = list(self.bots)
+        next_open = start
+
+        while True:
+            now = time.time()
+            if now - start >= args.duration:
+                break
+            while pending and now >= next_open:
+                self._open(pending.pop(0))
+                next_open += ramp_gap
+
+            for key, mask in self.sel.select(0.005):
+                b = key.data
+                if mask & selectors.EVENT_READ:
+                    try:
+                        data = b.sock.recv(65536)
+                    except (BlockingIOError, InterruptedError):
+                        data = None
+                    except OSError:
+                        self._drop(b)
+                        continue
+                    if data is not None:
+                        if not data:
+                            self._drop(b)
+                            continue
+                        t = time.time()
+                        try:
+                            msgs = b.framer.feed(data)
+                        except protocol.ProtocolError:
+                            self._drop(b)
+                            continue
+                        for msg in msgs:
+                            if isinstance(msg, str):
+                                self._on_line(b, msg, t)
+                            else:
+                                self._on_frame(b, *msg, t)
+                if b.sock is not None and mask & selectors.EVENT_WRITE:
+                    b.ready = True
+                    self.sel.modify(b.sock, selectors.EVENT_READ, b)
+
+            now = time.time()
+            for b in self.bots:
+                if b.sock is None:
+                    continue
+                self._script(b, now)
+                if b.ready and b.out:
+                    try:
+                        n = b.sock.send(b.out)
+                        del b.out[:n]
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    except OSError:
+                        self._drop(b)
+
+        elapsed = time.time() - start
+        cpu1 = cpu_seconds(pid) if pid else None
+        for b in self.bots:
+            if b.sock is not None:
+                self.sel.unregister(b.sock)
+                b.sock.close()
+        return self._summary(elapsed, cpu0, cpu1)
+
+    def _summary(self, elapsed: float, cpu0, cpu1) -> dict:
+        intervals, jitters, fanout = [], [], []
+        first: dict[int, float] = {}
+        for b in self.bots:
+            for tick, t in b.arrivals:
+                if t < first.get(tick, float("inf")):
+                    first[tick] = t
+        for b in self.bots:
+            gaps = [(t2 - t1) * 1000.0 for (_, t1), (_, t2) in zip(b.arrivals, b.arrivals[1:])]
+            intervals.extend(gaps)
+            if len(gaps) >= 2:
+                jitters.append(statistics.pstdev(gaps))
+            fanout.extend((t - first[tick]) * 1000.0 for tick, t in b.arrivals)
+        return {
+            "clients": len(self.bots),
+            "players": sum(b.player for b in self.bots),
+            "proto": self.args.proto,
+            "duration_s": round(elapsed, 2),
+            "connected": sum(b.connected for b in self.bots),
+            "dropped": sum(b.dropped for b in self.bots),
+            "states_received": sum(len(b.arrivals) for b in self.bots),
+            "state_interval_ms": percentiles(intervals),
+            "jitter_ms": percentiles(jitters),
+            "fanout_ms": percentiles(fanout),
+            "chat_rtt_ms": percentiles([r for b in self.bots for r in b.chat_rtt]),
+            "server_cpu_pct": round(100.0 * (cpu1 - cpu0) / elapsed, 1)
+            if cpu0 is not None and cpu1 is not None else None,
+        }
+
+    def write_csv(self, out):
+        w = csv.writer(out)
+        w.writerow(["name", "player", "states", "mean_interval_ms", "jitter_ms", "chat_rtt_ms", "dropped"])
+        for b in self.bots:
+            gaps = [(t2 - t1) * 1000.0 for (_, t1), (_, t2) in zip(b.arrivals, b.arrivals[1:])]
+            w.writerow([b.name, int(b.player), len(b.arrivals),
+                        round(statistics.fmean(gaps), 3) if gaps else "",
+                        round(statistics.pstdev(gaps), 3) if len(gaps) >= 2 else "",
+                        round(statistics.fmean(b.chat_rtt), 3) if b.chat_rtt else "",
+                        int(b.dropped)])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=5555)
+    ap.add_argument("--clients", type=int, default=100, help="total connections")
+    ap.add_argument("--players", type=int, default=10, help="how many of them queue to play")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    ap.add_argument("--ramp", type=float, default=200.0, help="new connections per second (0 = all at once)")
+    ap.add_argument("--proto", default="text", choices=["text", protocol.PROTO_BIN, protocol.PROTO_DELTA])
+    ap.add_argument("--input-interval", type=float, default=0.3, help="mean seconds between paddle changes")
+    ap.add_argument("--chat-rate", type=float, default=0.05, help="CHAT messages per second per client")
+    ap.add_argument("--server-pid", type=int, default=None, help="sample this process's CPU time")
+    ap.add_argument("--format", choices=["json", "csv"], default="json")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    gen = LoadGen(args)
+    summary = gen.run()
+    if args.format == "csv":
+        gen.write_csv(sys.stdout)
+    else:
+        print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
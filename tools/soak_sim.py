@@ -0,0 +1,68 @@
+"""Run many headless matches through MatchSim: throughput and replay check.
+
+    python tools/soak_sim.py --matches 200 --seed 7
+    python -m cProfile -s tottime tools/soak_sim.py --matches 50
+
+Each match gets its own seed and a seeded random-bot input stream, is run
+to completion (or --max-ticks), then replayed from the same seed and
+inputs; the two runs must end in the same state.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pong.sim import MatchSim
+
+
+def bot_inputs(seed: int, ticks: int) -> list[tuple[int, int]]:
+    # paddles hold a direction for a few ticks, then pick another
+    rng = random.Random(seed)
+    out = []
+    left = right = 0
+    for _ in range(ticks):
+        if rng.random() < 0.1:
+            left = rng.randrange(3) - 1
+        if rng.random() < 0.1:
+            right = rng.randrange(3) - 1
+        out.append((left, right))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--matches", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--max-ticks", type=int, default=60 * 60 * 5)
+    args = ap.parse_args()
+
+    master = random.Random(args.seed)
+    jobs = [(master.getrandbits(32), bot_inputs(master.getrandbits(32), args.max_ticks))
+            for _ in range(args.matches)]
+
+    ticks = 0
+    finals = []
+    t0 = time.perf_counter()
+    for seed, inputs in jobs:
+        sim = MatchSim(seed)
+        sim.run(inputs)
+        ticks += sim.tick
+        finals.append(sim.state())
+    elapsed = time.perf_counter() - t0
+
+    diverged = 0
+    for (seed, inputs), final in zip(jobs, finals):
+        sim = MatchSim(seed)
+        sim.run(inputs)
+        if sim.state() != final:
+            diverged += 1
+
+    print(f"matches={args.matches} ticks={ticks} elapsed={elapsed:.3f}s "
+          f"ticks/ms={ticks / (elapsed * 1000):.0f} replay_diverged={diverged}")
+
+
+if __name__ == "__main__":
+    main()